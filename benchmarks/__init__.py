@@ -0,0 +1,8 @@
+#!/usr/env python
+#
+# Headless benchmarks of the conversion of events to Sikulix commands.
+# Run from the main folder: python -m benchmarks --help
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
@@ -0,0 +1,149 @@
+#!/usr/env python
+#
+# Drives the handlers of code_events with the workloads and reports
+# events per second, latency per handler, peak memory and the number of
+# generated commands. No display, pynput or screen grabbing needed.
+#
+# Usage: python -m benchmarks [--json <file>] [--only <name>] [<recording> ...]
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import code_events
+import event_log
+from benchmarks import workloads
+from benchmarks.stub_capture import StubCaptureWorker
+
+handler_names = {event_log.MOTION: "handle_mouse_motion",
+                 event_log.KEY_PRESS: "handle_keys", event_log.KEY_RELEASE: "handle_keys",
+                 event_log.BUTTON_PRESS: "handle_mouse_buttons", event_log.BUTTON_RELEASE: "handle_mouse_buttons"}
+press_names = {event_log.KEY_PRESS: "Press", event_log.KEY_RELEASE: "Release",
+               event_log.BUTTON_PRESS: "Press", event_log.BUTTON_RELEASE: "Release"}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def _replay(events, latencies=None):
+    """ Feeds the events to the handlers of code_events. Returns the capture stub. """
+    stub = StubCaptureWorker()
+    code_events.reset()
+    code_events.capture_worker = stub
+    code_events.capture_images = True
+    clock = time.perf_counter_ns
+    for event in events:
+        t, kind, code, x, y = event
+        if kind == event_log.MOTION:
+            handler = code_events.handle_mouse_motion
+            args = (t, x, y)
+        elif kind in press_names:
+            handler = kind in (event_log.KEY_PRESS, event_log.KEY_RELEASE) and code_events.handle_keys or code_events.handle_mouse_buttons
+            args = (t, press_names[kind], code, x, y)
+        else:
+            continue
+        if code_events.time_of_last_command is None:
+            code_events.handle_first_time(t)
+        if latencies is None:
+            handler(*args)
+        else:
+            start = clock()
+            handler(*args)
+            latencies[handler_names[kind]].append(clock() - start)
+    code_events.clean_up()
+    return stub
+
+
+def run(name, events):
+    """ Runs one workload and returns the results as a dict. """
+    latencies = {"handle_mouse_motion": [], "handle_keys": [], "handle_mouse_buttons": []}
+    # Timing pass
+    start = time.perf_counter()
+    _replay(events)
+    seconds = time.perf_counter() - start
+    # Latency pass
+    _replay(events, latencies)
+    # Memory pass, tracemalloc slows everything down.
+    tracemalloc.start()
+    stub = _replay(events)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {"workload": name, "events": len(events), "seconds": seconds,
+              "events_per_second": len(events) / seconds if seconds else 0.0,
+              "peak_memory_bytes": peak, "commands": len(code_events.cmds.final),
+              "capture_requests": stub.requests, "handlers": {}}
+    for handler, values in latencies.items():
+        if values:
+            values.sort()
+            result["handlers"][handler] = {"calls": len(values),
+                                           "p50_us": _percentile(values, 0.50) / 1000.0,
+                                           "p99_us": _percentile(values, 0.99) / 1000.0,
+                                           "max_us": values[-1] / 1000.0}
+    return result
+
+
+def print_result(result):
+    print("%-20s %8d events %10.0f events/s %8.1f MB peak %7d commands %6d captures" % (
+        result["workload"], result["events"], result["events_per_second"],
+        result["peak_memory_bytes"] / 1e6, result["commands"], result["capture_requests"]))
+    for handler, stats in sorted(result["handlers"].items()):
+        print("    %-22s %8d calls  p50 %8.2f us  p99 %8.2f us  max %9.2f us" % (
+            handler, stats["calls"], stats["p50_us"], stats["p99_us"], stats["max_us"]))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print("Usage: python -m benchmarks [--json <file>] [--only <name>] [<recording> ...]")
+        print("Generated workloads: " + ", ".join(sorted(workloads.generated)))
+        sys.exit(0)
+    json_file = None
+    only = None
+    if "--json" in args:
+        index = args.index("--json")
+        json_file = args[index + 1]
+        del args[index:index + 2]
+    if "--only" in args:
+        index = args.index("--only")
+        only = args[index + 1]
+        del args[index:index + 2]
+
+    # Keep the prints of the handlers out of the measurements.
+    stdout = sys.stdout
+    results = []
+    for name, generate in sorted(workloads.generated.items()):
+        if only and name != only:
+            continue
+        events = generate()
+        sys.stdout = open(os.devnull, "w")
+        try:
+            result = run(name, events)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print_result(result)
+        results.append(result)
+    for filename in args:
+        events = workloads.load_recording(filename)
+        sys.stdout = open(os.devnull, "w")
+        try:
+            result = run(os.path.basename(filename), events)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print_result(result)
+        results.append(result)
+    if json_file:
+        with open(json_file, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,109 @@
+#!/usr/env python
+#
+# Microbenchmark of the translation of keys: the lookups in keymap
+# compared to the lists and if/elif chains they replaced.
+# Run from the main folder: python benchmarks/bench_keymap.py
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import keymap
+
+try:
+    from pynput import keyboard
+    keymap.load_pynput_keys(keyboard)
+except ImportError:
+    pass
+
+_xlib_names = ["Return", "Escape", "Tab", "BackSpace", "Delete", "F1", "F2", "F3", "F4",
+               "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "F13", "F14", "F15", "Insert",
+               "space", "Home", "End", "Left", "Right", "Down", "Up", "Next", "Page_Up", "Print",
+               "Pause", "Caps_Lock", "Scroll_Lock", "Num_Lock", "KP_Insert", "KP_End", "KP_Down",
+               "KP_Next", "KP_Left", "KP_Begin", "KP_Right", "KP_Home", "KP_Up", "KP_Page_Up",
+               "KP_Delete", "KP_Add", "KP_Subtract", "KP_Multiply", "KP_Divide", "KP_Enter"]
+_modifier_names = ["Control_L", "Shift_L", "Alt_L", "Super_L", "Control_R", "Shift_R", "Alt_R", "Super_R", "Menu"]
+
+
+def old_generator_lookup(char):
+    """ What code_events.handle_keys did per key: the modifier chain and a scan of the list of special keys. """
+    for name in _modifier_names:
+        if char == name:
+            return name
+    if not char in ["Return", "Escape", "Tab", "BackSpace", "Delete", "F1", "F2", "F3", "F4",
+                    "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "F13", "F14", "F15", "Insert",
+                    "space", "Home", "End", "Left", "Right", "Down", "Up", "Next", "Page_Up", "Print",
+                    "Pause", "Caps_Lock", "Scroll_Lock", "Num_Lock", "KP_Insert", "KP_End", "KP_Down",
+                    "KP_Next", "KP_Left", "KP_Begin", "KP_Right", "KP_Home", "KP_Up", "KP_Page_Up",
+                    "KP_Delete", "KP_Add", "KP_Subtract", "KP_Multiply", "KP_Divide", "KP_Enter"]:
+        return char
+    return "Key." + keymap.keys[char].sikulix
+
+
+def new_generator_lookup(char):
+    info = keymap.keys.get(char)
+    if info is None:
+        return char
+    return info.modifier or info.sikulix or info.char
+
+
+def old_recorder_lookup(key):
+    """ What record_events.on_key_press did per key. """
+    keyboard = keymap.keyboard
+    if key in [keyboard.Key.enter, keyboard.Key.esc, keyboard.Key.tab, keyboard.Key.backspace, keyboard.Key.delete, keyboard.Key.f1, keyboard.Key.f2, keyboard.Key.f3, keyboard.Key.f4, keyboard.Key.f5, keyboard.Key.f6, keyboard.Key.f7, keyboard.Key.f8, keyboard.Key.f9, keyboard.Key.f10, keyboard.Key.f11, keyboard.Key.f12, keyboard.Key.f13, keyboard.Key.f14, keyboard.Key.f15, keyboard.Key.insert, keyboard.Key.space, keyboard.Key.home, keyboard.Key.end, keyboard.Key.left, keyboard.Key.right, keyboard.Key.down, keyboard.Key.up, keyboard.Key.page_down, keyboard.Key.page_up, keyboard.Key.print_screen, keyboard.Key.pause, keyboard.Key.caps_lock, keyboard.Key.scroll_lock, keyboard.Key.num_lock]:
+        return str(key)[4:]
+    elif key == keyboard.Key.ctrl:
+        return "Control_L"
+    elif key == keyboard.Key.shift:
+        return "Shift_L"
+    elif key == keyboard.Key.alt:
+        return "Alt_L"
+    elif key == keyboard.Key.cmd:
+        return "Super_L"
+    elif key == keyboard.Key.ctrl_r:
+        return "Control_R"
+    elif key == keyboard.Key.shift_r:
+        return "Shift_R"
+    elif key == keyboard.Key.alt_r:
+        return "Alt_R"
+    elif key == keyboard.Key.cmd_r:
+        return "Super_R"
+    elif key == keyboard.Key.menu:
+        return "Menu"
+    return str(key)
+
+
+def new_recorder_lookup(key):
+    info = keymap.pynput_keys.get(key)
+    if info:
+        return info.name
+    return str(key)
+
+
+def report(name, function, keys, number):
+    seconds = timeit.timeit(lambda: [function(key) for key in keys], number=number)
+    per_key = seconds / (number * len(keys)) * 1e9
+    print("%-24s %8.0f ns per key" % (name, per_key))
+    return per_key
+
+
+if __name__ == "__main__":
+    number = 2000
+    # A mix of characters, modifiers and special keys like when typing text.
+    names = list("hello world") + ["Shift_L", "Return", "BackSpace", "KP_Enter", "comma", "F12"]
+    old = report("code_events (old)", old_generator_lookup, names, number)
+    new = report("code_events (keymap)", new_generator_lookup, names, number)
+    print("%.1fx faster" % (old / new))
+    if keymap.keyboard:
+        Key = keymap.keyboard.Key
+        pynput_keys = [keymap.keyboard.KeyCode.from_char(c) for c in "hello"] + [Key.shift, Key.enter, Key.menu, Key.num_lock, Key.ctrl_r]
+        old = report("record_events (old)", old_recorder_lookup, pynput_keys, number)
+        new = report("record_events (keymap)", new_recorder_lookup, pynput_keys, number)
+        print("%.1fx faster" % (old / new))
+    else:
+        print("pynput is not installed, skipped the recorder side.")
@@ -0,0 +1,103 @@
+#!/usr/env python
+#
+# Microbenchmark of the decoding of the data of X RECORD replies:
+# struct.iter_unpack over the core input events compared to the parser
+# of python-xlib, which creates an object for every event.
+# Run from the main folder: python benchmarks/bench_xrecord.py [<blobs>]
+# <blobs> is a file with the data of replies, each preceded by its length
+# as a 4 byte little endian number, like the file written by
+# python record_events_unix.py --save-replies. Without it, replies are generated.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# python -m pip install python-xlib
+# Licence GPL3
+
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Xlib import X
+from Xlib.protocol import event
+import record_events_unix
+
+
+class OfflineDisplay:
+    """ What the parser of python-xlib needs from a display, without a connection to an X server. """
+    event_classes = event.event_class
+
+    def get_resource_class(self, class_name, default=None):
+        return default
+
+
+def generate_replies(count=2000, events_per_reply=8):
+    """ Returns the data of count replies, mostly motion like a fast mouse, with clicks, keys and
+        now and then a MappingNotify. """
+    rng = random.Random(42)
+    replies = []
+    t = 1000
+    x = y = 500
+    for i in range(count):
+        data = b""
+        for j in range(events_per_reply):
+            t += rng.randint(1, 8)
+            x = max(0, min(1919, x + rng.randint(-20, 20)))
+            y = max(0, min(1079, y + rng.randint(-20, 20)))
+            choice = rng.random()
+            if choice < 0.8:
+                e = event.MotionNotify(detail=0, time=t, root=1, window=1, child=0, root_x=x, root_y=y,
+                                       event_x=x, event_y=y, state=0, same_screen=1, sequence_number=i)
+            elif choice < 0.9:
+                kind = rng.choice((event.ButtonPress, event.ButtonRelease))
+                e = kind(detail=1, time=t, root=1, window=1, child=0, root_x=x, root_y=y,
+                         event_x=x, event_y=y, state=0, same_screen=1, sequence_number=i)
+            elif choice < 0.999:
+                kind = rng.choice((event.KeyPress, event.KeyRelease))
+                e = kind(detail=rng.randint(10, 60), time=t, root=1, window=1, child=0, root_x=x, root_y=y,
+                         event_x=x, event_y=y, state=0, same_screen=1, sequence_number=i)
+            else:
+                e = event.MappingNotify(request=X.MappingKeyboard, first_keycode=8, count=248, sequence_number=i)
+            data += e._binary
+        replies.append(data)
+    return replies
+
+
+def read_replies(filename):
+    replies = []
+    with open(filename, "rb") as f:
+        blob = f.read()
+    offset = 0
+    while offset < len(blob):
+        length = struct.unpack_from("<I", blob, offset)[0]
+        replies.append(blob[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    return replies
+
+
+def decode_all(decoder, replies, dpy):
+    return [tuple(decoded[:5]) for data in replies for decoded in decoder(data, dpy)]
+
+
+def report(name, decoder, replies, dpy, number):
+    seconds = timeit.timeit(lambda: decode_all(decoder, replies, dpy), number=number)
+    events = len(decode_all(decoder, replies, dpy))
+    per_event = seconds / (number * events) * 1e9
+    print("%-24s %8.0f ns per event" % (name, per_event))
+    return per_event
+
+
+if __name__ == "__main__":
+    replies = read_replies(sys.argv[1]) if len(sys.argv) > 1 else generate_replies()
+    dpy = OfflineDisplay()
+    # Both paths must give the same events.
+    if decode_all(record_events_unix.parse_events, replies, dpy) != decode_all(record_events_unix.decode_events, replies, dpy):
+        print("The decoded events differ.")
+        sys.exit(1)
+    number = 5
+    print("%d replies, %d events" % (len(replies), len(decode_all(record_events_unix.decode_events, replies, dpy))))
+    old = report("python-xlib parser", record_events_unix.parse_events, replies, dpy, number)
+    new = report("struct.iter_unpack", record_events_unix.decode_events, replies, dpy, number)
+    print("%.1fx faster" % (old / new))
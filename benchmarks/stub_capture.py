@@ -0,0 +1,47 @@
+#!/usr/env python
+#
+# Replaces capture.CaptureWorker, so code_events can run without a display.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+
+class StubCaptureWorker:
+    """ Same interface as capture.CaptureWorker. Only counts the requests, nothing is grabbed or saved. """
+
+    def __init__(self):
+        self.requests = 0
+        self.files = set()
+        self.screen_size = None
+
+    def start(self):
+        pass
+
+    def request(self, fname, bbox):
+        self.requests += 1
+        self.files.add(fname)
+
+    def pending(self):
+        return 0
+
+    def done(self, fname):
+        return True
+
+    def flush(self):
+        pass
+
+    def encode(self, workers=None):
+        return 0
+
+    def alias(self, fname):
+        return fname
+
+    def pattern(self, fname):
+        return None
+
+    def reset(self):
+        pass
+
+    def stop(self):
+        pass
@@ -0,0 +1,128 @@
+#!/usr/env python
+#
+# Workloads for the benchmarks: generated traces of typical recordings
+# and recordings saved by the recorders.
+# Every workload is a list of event_log.Event tuples.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import json
+import math
+import random
+import event_log
+import journal
+
+Event = event_log.Event
+
+
+def _key(events, t, name, x, y, hold=40):
+    events.append(Event(t, event_log.KEY_PRESS, name, x, y))
+    events.append(Event(t + hold, event_log.KEY_RELEASE, name, x, y))
+    return t + hold
+
+
+def _click(events, t, button, x, y, hold=80):
+    events.append(Event(t, event_log.BUTTON_PRESS, button, x, y))
+    events.append(Event(t + hold, event_log.BUTTON_RELEASE, button, x, y))
+    return t + hold
+
+
+def long_drag(points=50000, rate=1000):
+    """ A drawing: press the left button and move along a curve at rate events per second. """
+    events = []
+    t = 1000
+    x, y = 400, 400
+    events.append(Event(t, event_log.BUTTON_PRESS, 1, x, y))
+    for i in range(points):
+        t += 1000 // rate
+        x = int(400 + 300 * math.cos(i / 900.0) + i / 200.0)
+        y = int(400 + 250 * math.sin(i / 700.0))
+        events.append(Event(t, event_log.MOTION, 0, x, y))
+    events.append(Event(t + 5, event_log.BUTTON_RELEASE, 1, x, y))
+    return events
+
+
+def fast_typing(chars=5000, seed=1):
+    """ Typing text at about 15 keys per second, with capitals, punctuation and some Enter keys. """
+    rnd = random.Random(seed)
+    text = "The quick brown fox jumps over the lazy dog, again and again. "
+    events = []
+    t = 1000
+    for i in range(chars):
+        char = text[i % len(text)]
+        if char == " ":
+            name = "space"
+        elif char in ",.":
+            name = {",": "comma", ".": "period"}[char]
+        else:
+            name = char.lower()
+        if char.isupper():
+            events.append(Event(t, event_log.KEY_PRESS, "Shift_L", 500, 500))
+            t = _key(events, t + 20, name, 500, 500)
+            events.append(Event(t + 10, event_log.KEY_RELEASE, "Shift_L", 500, 500))
+        else:
+            t = _key(events, t, name, 500, 500, rnd.randint(30, 90))
+        if i % 200 == 199:
+            t = _key(events, t + 50, "Return", 500, 500)
+        t += rnd.randint(20, 120)
+    return events
+
+
+def wheel_bursts(bursts=500, notches=10):
+    """ Scrolling: bursts of wheel notches with a short mouse move in between. """
+    events = []
+    t = 1000
+    x, y = 600, 300
+    for burst in range(bursts):
+        for i in range(20):
+            t += 8
+            x += 1
+            events.append(Event(t, event_log.MOTION, 0, x, y))
+        button = burst % 2 and 4 or 5
+        for notch in range(notches):
+            t = _click(events, t + 30, button, x, y, 0)
+    return events
+
+
+def region_captures(regions=300):
+    """ SHIFT region captures followed by a move to the click point, and CTRL highlights. """
+    events = []
+    t = 1000
+    for region in range(regions):
+        x, y = 100 + region % 50 * 10, 100 + region % 30 * 10
+        key = region % 3 and "Shift_L" or "Control_L"
+        events.append(Event(t, event_log.KEY_PRESS, key, x, y))
+        for i in range(60):
+            t += 5
+            x += 2
+            y += 1
+            events.append(Event(t, event_log.MOTION, 0, x, y))
+        t += 10
+        events.append(Event(t, event_log.KEY_RELEASE, key, x, y))
+        for i in range(40):
+            t += 5
+            x -= 1
+            y -= 1
+            events.append(Event(t, event_log.MOTION, 0, x, y))
+        t = _click(events, t + 100, 1, x, y)
+        t += 300
+    return events
+
+
+generated = {"long_drag": long_drag, "fast_typing": fast_typing, "wheel_bursts": wheel_bursts,
+             "region_captures": region_captures}
+
+
+def load_recording(filename):
+    """ Reads the events of an eventrecord.json, eventrecord.txt or a journal (.ndjson). """
+    if filename.endswith(".ndjson"):
+        return list(journal.read_journal(filename))
+    if filename.endswith(".json"):
+        with open(filename, "r") as file:
+            lines = json.load(file)
+    else:
+        with open(filename, "r", encoding="utf-8") as file:
+            lines = file.readlines()
+    return [event_log.parse_event(line) for line in lines]
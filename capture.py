@@ -0,0 +1,350 @@
+#!/usr/env python
+#
+# Takes the screenshots of the images selected while recording.
+# The grabbing and saving is done on a background thread, so the
+# handlers called by the input hooks only have to queue a request.
+# The pixels are hashed before encoding, so unchanged and duplicate
+# images are not written again. The png encoding can be deferred to the
+# end of the recording, where it is done on all cores.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# python -m pip install pillow
+# Licence GPL3
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import stats
+
+# pillow and concurrent.futures are imported when first needed, so they don't slow down the start of the recorder.
+
+
+def make_grabber(backend="auto"):
+    """ Returns a function that grabs a region of the screen like ImageGrab.grab(bbox).
+        backend is "pil", "xlib" or "auto" (xlib on Linux with X, pil otherwise).
+        Falls back to pil if xlib can't be used. """
+    if backend == "xlib" or (backend == "auto" and sys.platform.startswith("linux") and os.environ.get("DISPLAY")):
+        try:
+            import capture_xlib
+            grabber = capture_xlib.XlibGrabber()
+            grabber.warm_up()
+            return grabber
+        except Exception as e:
+            print("Unable to grab the screen with Xlib, using pillow: %s" % e)
+    from PIL import ImageGrab
+    return ImageGrab.grab
+
+
+def screen_size(grab):
+    """ Returns the (width, height) of the screen grabbed by grab, a function of make_grabber(). """
+    if hasattr(grab, "width"):
+        # XlibGrabber, already knows it.
+        return (grab.width, grab.height)
+    return grab().size
+
+
+def _encode(job):
+    """ Saves the raw pixels of a deferred capture as a png file. Runs in the worker processes of encode(). """
+    from PIL import Image
+    fname, mode, size, data, path, compress_level = job
+    if data is None:
+        with open(path, "rb") as file:
+            data = file.read()
+    Image.frombytes(mode, size, data).save(fname, format="png", compress_level=compress_level)
+    return fname
+
+
+class CaptureWorker:
+    """ Grabs regions of the screen and saves them as png files on a background thread.
+        Requests are keyed by file name. Only the newest pending request of a file is
+        kept (latest wins), because the older one would be overwritten anyway.
+        A file is sealed when a request for another file is handled. If the pixels of a
+        file are the same as those of a sealed file, it isn't written and alias() returns
+        the name of the sealed file.
+        With defer_encoding the pixels are kept until encode() is called, at most max_memory
+        bytes in memory, the rest is spilled to temporary files in spill_folder.
+        The screen is grabbed with make_grabber(backend), unless grab is given.
+        With tune_patterns the first capture of a file is compared with the whole screen, and
+        only the smallest unique part of it is saved (see patterns.py and pattern()). """
+
+    def __init__(self, defer_encoding=False, compress_level=6, max_memory=256 * 1024 * 1024, spill_folder=None,
+                 backend="auto", grab=None, tune_patterns=False):
+        self.backend = backend
+        self.grab = grab
+        self.tune_patterns = tune_patterns
+        self._patterns = {}         # file name -> patterns.PatternInfo
+        self.defer_encoding = defer_encoding
+        self.compress_level = compress_level    # 0 (none, fast) - 9 (smallest, slow)
+        self.max_memory = max_memory
+        self.spill_folder = spill_folder        # None for the default temporary folder.
+        self._deferred = {}         # file name -> (mode, size, pixels or None, spill file or None)
+        self._deferred_bytes = 0    # The size of the pixels kept in memory.
+        self._hashes = {}           # file name -> hash of the pixels written to it.
+        self._sealed = {}           # hash -> name of the sealed file with these pixels.
+        self._aliases = {}          # file name -> name of the sealed file with the same pixels.
+        self._current = None        # The file that is not sealed yet.
+        self._pending = {}          # file name -> bbox of the newest request not yet handled.
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._busy = False          # True while the thread is grabbing or saving outside of the lock.
+        self._handling = None       # The file the thread is grabbing or saving.
+        self._running = False
+        self._thread = None
+        self.failed = False         # True if the screen grabber couldn't be created, no images are saved.
+        self.screen_size = None     # (width, height) of the screen, once the grabber is ready.
+
+    def start(self):
+        """ Starts the background thread. Called automatically by the first request. Start it
+            before recording, so the screen grabber is ready when the first image is requested. """
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            # flush() waits until the grabber is ready.
+            self._busy = self.grab is None
+            self._thread = threading.Thread(target=self._run, name="capture-worker", daemon=True)
+            self._thread.start()
+
+    def request(self, fname, bbox):
+        """ Queue a screenshot of bbox (left, top, right, bottom) to be saved as fname.
+            Replaces a pending request for the same file. Never blocks on the grab itself. """
+        if not self._running:
+            self.start()
+        with self._lock:
+            if self.failed:
+                return
+            if stats.enabled and fname in self._pending:
+                stats.count("capture requests replaced")
+            self._pending[fname] = bbox
+            self._changed.notify_all()
+
+    def pending(self):
+        """ Returns the number of requests waiting to be handled. """
+        with self._lock:
+            return len(self._pending) + (1 if self._busy else 0)
+
+    def done(self, fname):
+        """ Returns True if no request of fname is waiting or being handled, so alias() and pattern()
+            of fname don't change unless it is requested again. """
+        with self._lock:
+            return self.failed or (fname not in self._pending and fname != self._handling)
+
+    def flush(self):
+        """ Waits until all queued screenshots are saved. """
+        with self._lock:
+            while (self._pending or self._busy) and not self.failed:
+                self._changed.wait()
+
+    def encode(self, workers=None):
+        """ Encodes the deferred captures as png files with a pool of worker processes (one per core
+            by default). Call flush() first. Returns the number of files written. """
+        with self._lock:
+            jobs = [(fname, mode, size, data, path, self.compress_level)
+                    for fname, (mode, size, data, path) in self._deferred.items()]
+            self._deferred = {}
+            self._deferred_bytes = 0
+        if not jobs:
+            return 0
+        start = time.perf_counter_ns()
+        done = False
+        if len(jobs) > 1 and (workers or os.cpu_count() or 1) > 1:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(workers) as pool:
+                    for fname in pool.map(_encode, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count())))):
+                        pass
+                done = True
+            except Exception as e:
+                print("Unable to encode the images in parallel, encoding them one by one: %s" % e)
+        if not done:
+            for job in jobs:
+                try:
+                    _encode(job)
+                except Exception as e:
+                    print(e)
+                    print("Unable to generate: " + job[0])
+        for job in jobs:
+            if job[4]:
+                os.remove(job[4])
+        if stats.enabled:
+            stats.observe("deferred encode", (time.perf_counter_ns() - start) // 1000, "us")
+        return len(jobs)
+
+    def alias(self, fname):
+        """ Returns the name of the file with the pixels of fname. Call flush() first. """
+        return self._aliases.get(fname, fname)
+
+    def pattern(self, fname):
+        """ Returns the patterns.PatternInfo of fname, None if it wasn't tuned. Call flush() first. """
+        return self._patterns.get(fname)
+
+    def reset(self):
+        """ Forgets the images of a previous recording. """
+        self.flush()
+        with self._lock:
+            self._hashes.clear()
+            self._sealed.clear()
+            self._aliases.clear()
+            self._patterns.clear()
+            self._current = None
+            spilled = [self._forget(fname) for fname in list(self._deferred)]
+        for path in spilled:
+            if path:
+                os.remove(path)
+
+    def stop(self):
+        """ Saves what is still queued and stops the background thread. """
+        self.flush()
+        with self._lock:
+            self._running = False
+            self._changed.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        if self.grab is None:
+            try:
+                grab = make_grabber(self.backend)
+                self.screen_size = screen_size(grab)
+            except Exception as e:
+                print("Unable to grab the screen, no images will be saved: %s" % e)
+                grab = None
+            with self._lock:
+                self.grab = grab
+                self._busy = False
+                if grab is None:
+                    # request(), flush() and done() return at once from now on.
+                    self.failed = True
+                    self._pending.clear()
+                self._changed.notify_all()
+            if grab is None:
+                return
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._changed.wait()
+                if not self._pending:
+                    return
+                fname = next(iter(self._pending))
+                bbox = self._pending.pop(fname)
+                self._busy = True
+                self._handling = fname
+                if hasattr(self.grab, "share"):
+                    # XlibGrabber: cut the images waiting now from one grab of the full screen.
+                    self.grab.share = bool(self._pending)
+            try:
+                self._capture(fname, bbox)
+            finally:
+                with self._lock:
+                    self._busy = False
+                    self._handling = None
+                    self._changed.notify_all()
+
+    def _seal(self, fname):
+        digest = self._hashes.get(fname)
+        if digest is not None and fname not in self._aliases:
+            self._sealed.setdefault(digest, fname)
+
+    def _forget(self, fname):
+        """ Drops the deferred pixels of fname. Call with the lock held. Returns the spill file of fname,
+            to be removed after releasing the lock, or None. """
+        entry = self._deferred.pop(fname, None)
+        if entry:
+            mode, size, data, path = entry
+            if data is not None:
+                self._deferred_bytes -= len(data)
+            return path
+        return None
+
+    def _defer(self, fname, mode, size, data):
+        """ Keeps the pixels of fname until encode(). The spill files are written and removed outside
+            of the lock, request() doesn't wait for the disk. """
+        with self._lock:
+            stale = self._forget(fname)
+            spill = self._deferred_bytes + len(data) > self.max_memory
+            if not spill:
+                self._deferred[fname] = (mode, size, data, None)
+                self._deferred_bytes += len(data)
+        if stale:
+            os.remove(stale)
+        if spill:
+            handle, path = tempfile.mkstemp(prefix="capture-", suffix=".raw", dir=self.spill_folder)
+            with os.fdopen(handle, "wb") as file:
+                file.write(data)
+            # Only this thread adds deferred pixels.
+            with self._lock:
+                self._deferred[fname] = (mode, size, None, path)
+            if stats.enabled:
+                stats.count("captures spilled")
+
+    def _tune(self, fname, bbox):
+        """ Grabs the whole screen, finds the smallest unique part of bbox and returns it. """
+        import patterns
+        screen = self.grab(None)
+        start = time.perf_counter_ns()
+        info = patterns.tune(screen, bbox)
+        if stats.enabled:
+            stats.observe("pattern tuning", (time.perf_counter_ns() - start) // 1000, "us")
+        if info is None:
+            return screen.crop(bbox)
+        with self._lock:
+            self._patterns[fname] = info
+        return screen.crop(info.crop)
+
+    def _capture(self, fname, bbox):
+        try:
+            if fname != self._current:
+                if self._current:
+                    self._seal(self._current)
+                self._current = fname
+            start = time.perf_counter_ns()
+            info = self._patterns.get(fname)
+            if info:
+                screenshot = self.grab(info.crop)
+            elif self.tune_patterns:
+                screenshot = self._tune(fname, bbox)
+            else:
+                screenshot = self.grab(bbox)
+            grabbed = time.perf_counter_ns()
+            if stats.enabled:
+                stats.observe("capture grab", (grabbed - start) // 1000, "us")
+            pixels = screenshot.tobytes()
+            digest = hashlib.blake2b(pixels, digest_size=16)
+            digest.update(("%s %d %d" % (screenshot.mode, screenshot.width, screenshot.height)).encode())
+            digest = digest.digest()
+            if self._hashes.get(fname) == digest:
+                # Nothing changed since the last time.
+                if stats.enabled:
+                    stats.count("captures unchanged")
+                return
+            self._hashes[fname] = digest
+            same = self._sealed.get(digest)
+            if same is not None and same != fname:
+                # An image with the same pixels is already on disk.
+                with self._lock:
+                    self._aliases[fname] = same
+                    stale = self._forget(fname)
+                if stale:
+                    os.remove(stale)
+                if os.path.exists(fname):
+                    os.remove(fname)
+                if stats.enabled:
+                    stats.count("captures deduplicated")
+                return
+            with self._lock:
+                self._aliases.pop(fname, None)
+            if self.defer_encoding:
+                self._defer(fname, screenshot.mode, screenshot.size, pixels)
+                return
+            screenshot.save(fname, format="png", compress_level=self.compress_level)
+            if stats.enabled:
+                stats.count("captures saved")
+                stats.observe("capture encode", (time.perf_counter_ns() - grabbed) // 1000, "us")
+        except Exception as e:
+            print(e)
+            print("Unable to generate: " + fname)
@@ -0,0 +1,92 @@
+#!/usr/env python
+#
+# Screen grabbing with python-xlib for the capture worker on Linux.
+# One connection to the X server stays open, instead of a new one for
+# every grab. Only the requested region is grabbed, unless more images
+# are waiting: then the full screen is grabbed and kept for a short
+# time, so they are cut from the same grab.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# python -m pip install python-xlib pillow
+# Licence GPL3
+
+import time
+from PIL import Image
+from Xlib import X, display
+import stats
+
+
+class XlibGrabber:
+    """ Callable with the same arguments as ImageGrab.grab(bbox). Use from one thread only.
+        ttl: the number of seconds a grab of the full screen is used for other images.
+        full_frame: always grab the full screen and cut the regions from it.
+        Set share to True while more images are waiting to be grabbed, to cut them from one grab of
+        the full screen. python-xlib has no MIT-SHM, the pixels are sent over the connection, so
+        otherwise only the requested region is grabbed. """
+
+    def __init__(self, ttl=0.05, full_frame=False):
+        self.ttl = ttl
+        self.full_frame = full_frame
+        self.share = False
+        self.display = None
+        self.root = None
+        self.width = 0
+        self.height = 0
+        self._raw_mode = "BGRX"
+        self._frame = None          # The last full screen grab
+        self._frame_time = 0.0
+
+    def warm_up(self):
+        """ Opens the connection and grabs the screen once, so the first image doesn't have to wait for it. """
+        if self.display is None:
+            self.display = display.Display()
+            screen = self.display.screen()
+            self.root = screen.root
+            self.width = screen.width_in_pixels
+            self.height = screen.height_in_pixels
+            if screen.root_depth not in (24, 32):
+                raise ValueError("Unsupported screen depth %d" % screen.root_depth)
+            if self.display.display.info.image_byte_order != X.LSBFirst:
+                self._raw_mode = "XRGB"
+        self._grab_frame()
+
+    def close(self):
+        if self.display is not None:
+            self.display.close()
+            self.display = None
+        self._frame = None
+
+    def _get_image(self, x, y, width, height):
+        reply = self.root.get_image(x, y, width, height, X.ZPixmap, 0xffffffff)
+        return Image.frombuffer("RGB", (width, height), reply.data, "raw", self._raw_mode, 0, 1)
+
+    def _grab_frame(self):
+        start = time.perf_counter_ns()
+        self._frame = self._get_image(0, 0, self.width, self.height)
+        self._frame_time = time.monotonic()
+        if stats.enabled:
+            stats.observe("xlib full frame grab", (time.perf_counter_ns() - start) // 1000, "us")
+        return self._frame
+
+    def __call__(self, bbox=None):
+        if self.display is None:
+            self.warm_up()
+        if bbox is None:
+            return self._grab_frame().copy()
+        left, top, right, bottom = bbox
+        left = max(0, left)
+        top = max(0, top)
+        right = min(self.width, right)
+        bottom = min(self.height, bottom)
+        if right <= left or bottom <= top:
+            raise ValueError("Region %s is outside the screen" % (bbox,))
+        if not (self.full_frame or self.share):
+            return self._get_image(left, top, right - left, bottom - top)
+        if self._frame is not None and time.monotonic() - self._frame_time < self.ttl:
+            if stats.enabled:
+                stats.count("xlib frame cache hits")
+            frame = self._frame
+        else:
+            frame = self._grab_frame()
+        return frame.crop((left, top, right, bottom))
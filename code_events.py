@@ -10,7 +10,15 @@
 
 
 import json
-from PIL import ImageGrab
+import os
+from collections import deque
+import capture
+import event_log
+import simplify
+import keymap
+import stats
+import commands
+import script
 
 shift_chars = {"US": {",":"<", ".":">", "/":"?", ";":":", "'":"\\\"", "\\":"|", "[":"{", "]":"}", "`":"~", 
                       "1":"!", "2":"@", "3":"#", "4":"$", "5":"%", "6":"^", "7":"&", "8":"*", "9":"(", 
@@ -19,164 +27,178 @@ shift_chars = {"US": {",":"<", ".":">", "/":"?", ";":":", "'":"\\\"", "\\":"|",
 keyboard_layout = "US"
 
 mouse_button_codes = {1:"Button.LEFT", 2:"Button.MIDDLE", 3:"Button.RIGHT", 4:"Button.WHEEL_UP", 5:"Button.WHEEL_DOWN"}
-# Needed when using xlib instead of pynput
-special_chars = {"comma":",", "period":".", "slash":"/", "semicolon":";", "apostrophe":"'", "backslash":"\\",
-                             "bracketleft":"[", "bracketright":"]", "grave":"`", "minus":"-", "equal":"=",}
-# For xlib
-# sikulixkeys = {"Return":"ENTER", "Escape":"ESC", "Tab":"TAB", "BackSpace":"BACKSPACE", 
-#                "Delete": "DELETE", "F1":"F1", "F2":"F2", "F3":"F3", "F4":"F4", 
-#                "F5":"F5", "F6":"F6", "F7":"F7", "F8":"F8", "F9":"F9", "F10":"F10", 
-#                "F11":"F11", "F12":"F12", "F13":"F13", "F14":"F14", "F15":"F15", 
-#                "Insert": "INSERT", "space": "SPACE", "Home": "HOME", "End":"END", 
-#                "Left":"LEFT", "Right":"RIGHT", "Down":"DOWN", "Up":"UP", "Next":"PAGE_DOWN", 
-#                "Page_Up":"PAGE_UP", "Print":"PRINTSCREEN", "Pause":"PAUSE", 
-#                "Caps_Lock":"CAPS_LOCK", "Scroll_Lock":"SCROLL_LOCK", "Num_Lock":"NUM_LOCK",
-#                "KP_Insert":"NUM0", "KP_End":"NUM1", "KP_Down":"NUM2", "KP_Next":"NUM3", 
-#                "KP_Left":"NUM4", "KP_Begin":"NUM5", "KP_Right":"NUM6", 
-#                "KP_Home":"NUM7", "KP_Up":"NUM8", "KP_Page_Up":"NUM9", "KP_Delete":"SEPARATOR", 
-#                "KP_Add":"ADD", "KP_Subtract":"MINUS", "KP_Multiply":"MULTIPLY",
-#                "KP_Divide":"DIVIDE", "KP_Enter": "ENTER"}
-# For pynput
-sikulixkey = {"enter":"ENTER", "esc":"ESC", "tab":"TAB", "backspace":"BACKSPACE", 
-               "delete": "DELETE", "f1":"F1", "f2":"F2", "f3":"F3", "f4":"F4", 
-               "f5":"F5", "f6":"F6", "f7":"F7", "f8":"F8", "f9":"F9", "f10":"F10", 
-               "f11":"F11", "f12":"F12", "f13":"F13", "f14":"F14", "f15":"F15", 
-               "insert": "INSERT", "space": "SPACE", "home": "HOME", "end":"END", 
-               "left":"LEFT", "right":"RIGHT", "down":"DOWN", "up":"UP", "page_down":"PAGE_DOWN", 
-               "page_up":"PAGE_UP", "print_screen":"PRINTSCREEN", "pause":"PAUSE", 
-               "caps_lock":"CAPS_LOCK", "scroll_lock":"SCROLL_LOCK", "num_lock":"NUM_LOCK",
-               "KP_Divide":"DIVIDE", "<65437>":"5"}
+# The names of the keys, the Sikulix keys and the modifiers are in keymap.
 
 # Globals to make this work.
 output_folder = "/tmp/test.sikuli/"
-cmds = []
-mouse_movements = []
+cmds = script.CommandSink()     # commands.* objects, str() gives the line of the script. Final commands are passed on to cmds.output.
+script_writer = None            # The script.ScriptWriter of write_script(), closed by clean_up().
+mouse_movements = deque(maxlen=1000)    # The most recent events
 
 previous_event = None
 previous_char = None
-motions = [] # Stores a list of motion events, that is converted to commands when something else happens (a click, a key pressed, end of program)
+motions = [] # In "rdp" mode stores a list of motion events, that is converted to commands when something else happens (a click, a key pressed, end of program)
+motion_count = 0                # The number of motion events since something else happened.
+last_motion = None              # The last motion event. It always results in a mouseMove command when something else happens.
+slope_filter = simplify.SlopeFilter()   # Selects the mouseMove commands while the mouse moves (not in "rdp" mode).
+max_motions = 4096              # In "rdp" mode the motion is simplified in chunks of this many events to limit the memory used.
+release_interval = 64           # The mouseMove commands of a motion are passed on every this many motion events.
 time_of_last_command = None
 key_pressed_while_holding_ctrl_or_shift = False
 mouse_moved = False
 left_shift_region = False       # Just created an image by holding left SHIFT and moving the mouse.
-current_cmds_length = 0         # When start holding left SHIFT or CTRL we record the length of the commands list to be able to later remove the motion commands
+current_cmds_length = 0         # When start holding left SHIFT or CTRL we record a savepoint of cmds to be able to later remove the motion commands
 center_of_image = [0,0]
 image_cnt = 1                   # The name of an image stored while holding LEFT SHIFT
 fname = ""                      # The actual file name of an image stored while holding LEFT SHIFT
 coordinates = None              # The coordinates of this image on the screen.
 start_snapping = False          # After releasing the left shift the mouse will move to the click point. Then the underlaying screen might change, so we will take a snapshot with the same name each motion event until we receive a button press.
+capture_worker = capture.CaptureWorker()    # Grabs and saves the images on a background thread, so the handlers only queue a request.
+capture_images = True           # False when converting a recording offline: the images are not grabbed (they may already be on disk).
 precision = 6
 step_size = 15                  # the number of events that are always skipped between two mouseMove commands
+simplify_mode = "slope"         # "slope": use precision and step_size. "rdp": keep the path within tolerance pixels (Ramer-Douglas-Peucker).
+tolerance = 2.0                 # Max distance in pixels between the recorded and the simplified path in "rdp" mode.
+optimize_commands = True        # Run the peephole optimizer of commands.py over cmds.final at clean_up, or in the script_writer.
+max_type_delay = 1.0            # Keystrokes less than this many seconds apart are typed with one type() command.
+max_wheel_gap = 0.5             # Notches of the mouse wheel less than this many seconds apart become one wheel() command.
+speed = 1.0                     # Replay speed: 2.0 halves every wait and delay.
+max_idle = None                 # The maximum number of seconds of any single wait or delay (after applying speed), None for no limit.
+min_delay = 0.0                 # The minimum number of seconds of any wait or delay.
+search_padding = None           # Search images first within this many pixels of where they were recorded, None to search the whole screen.
+search_wait = 1                 # The number of seconds to search near the recorded location before searching the whole screen.
 modifiers = {"button 1 down": False, "button 2 down": False, "button 3 down": False, "button 4 down": False, 
             "button 5 down": False, "left control down": False, "right control down": False, "left shift down": False, 
             "right shift down": False, "left alt down": False, "right alt down": False,  
             "left windows down": False, "right windows down": False, "context menu down": False}
 
 
+def reset():
+    """ Forget everything of a previous recording, so a new one can be converted. The script opened
+        by write_script() stays open, so it can be called before Recorder.start() resets. """
+    global cmds, mouse_movements, previous_event, previous_char, motions, motion_count, last_motion, time_of_last_command
+    global key_pressed_while_holding_ctrl_or_shift, mouse_moved, left_shift_region, current_cmds_length
+    global center_of_image, image_cnt, fname, coordinates, start_snapping
+    cmds = script.CommandSink(script_writer and script_writer.write)
+    mouse_movements = deque(maxlen=1000)
+    previous_event = None
+    previous_char = None
+    motions = []
+    motion_count = 0
+    last_motion = None
+    time_of_last_command = None
+    key_pressed_while_holding_ctrl_or_shift = False
+    mouse_moved = False
+    left_shift_region = False
+    current_cmds_length = 0
+    center_of_image = [0,0]
+    image_cnt = 1
+    fname = ""
+    coordinates = None
+    start_snapping = False
+    for modifier in modifiers:
+        modifiers[modifier] = False
+    capture_worker.reset()
+
 def handle_first_time(time):
     """ This function should be called when the first event is received before it is handled. """
     global time_of_last_command
     time_of_last_command = time
 
-def _get_slopes(x_values, y_values):
-    """ Returns a list of changes in slope. """
-    idx = []
-    if x_values[1] - x_values[0] == 0:
-        prior_slope = "straight up or down"
-    else:
-        prior_slope = float(y_values[1] - y_values[0]) / (x_values[1] - x_values[0])
-    for n in range(2, len(x_values)):  # Start from 3rd pair of points.
-        if x_values[n] - x_values[n - 1] == 0:
-            slope = "straight up or down"
-        else:
-            slope = float(y_values[n] - y_values[n - 1]) / (x_values[n] - x_values[n - 1])
-        
-        if type(slope) is str or type(prior_slope) is str:
-            if slope != prior_slope:
-                if not type(slope) is str:
-                    if abs(slope) < precision:
-                        idx.append(n)
-                else:
-                    if abs(prior_slope) < precision:
-                        idx.append(n)
-        elif abs(slope - prior_slope) > precision:
-            idx.append(n)
-        prior_slope = slope
-    return idx
-
 def _set_modifiers(char, value):
     """ Maintains the list that shows which modifiers are currently pressed. 
-        Returns the list and if the current key is a modifier. """
-    global modifiers
-    key_is_modifier = True
-    if char == "Control_L":
-        modifiers["left control down"] = value
-    elif char == "Shift_L":
-        modifiers["left shift down"] = value
-    elif char == "Alt_L":
-        modifiers["left alt down"] = value
-    elif char == "Super_L":
-        modifiers["left windows down"] = value
-    elif char == "Control_R":
-        modifiers["right control down"] = value
-    elif char == "Shift_R":
-        modifiers["right shift down"] = value
-    elif char == "Alt_R":
-        modifiers["right alt down"] = value
-    elif char == "Super_R":
-        modifiers["right windows down"] = value
-    elif char == "Menu":
-        modifiers["context menu down"] = value
-    else:
-        key_is_modifier = False
-    return key_is_modifier
+        Returns if the current key is a modifier. """
+    info = keymap.keys.get(char)
+    if info is None or info.modifier is None:
+        return False
+    modifiers[info.modifier] = value
+    return True
 
-def _handle_motions():
-    """ Returns the moveMouse commands. """
-    global cmds
+def _seconds(ms):
+    """ Converts the time in ms between two events to the seconds of a wait or delay in the script,
+        applying speed, max_idle and min_delay. """
+    seconds = ms / 1000.0 / speed
+    if max_idle is not None and seconds > max_idle:
+        seconds = max_idle
+    if seconds < min_delay:
+        seconds = min_delay
+    return seconds
+
+def _search_region():
+    """ Returns the region (x, y, w, h) around the last image, padded with search_padding pixels
+        and kept on the screen. None if search_padding is not set. """
+    if search_padding is None or coordinates is None:
+        return None
+    left, top, right, bottom = coordinates
+    x = max(0, left - search_padding)
+    y = max(0, top - search_padding)
+    right += search_padding
+    bottom += search_padding
+    size = capture_worker.screen_size
+    if size:
+        right = min(right, size[0])
+        bottom = min(bottom, size[1])
+    return (x, y, right - x, bottom - y)
+
+def _move_mouse(motion):
+    """ Adds the commands to move the mouse to the location of a motion event. """
     global time_of_last_command
+    time = motion[0]
+    cmds.append(commands.Setting("MoveMouseDelay", _seconds(time - time_of_last_command)))
+    cmds.append(commands.MouseMove(motion[-2], motion[-1]))
+    time_of_last_command = time
+
+def _add_motion(motion):
+    """ Creates the mouseMove commands while the mouse moves, so little work is left when something else happens. """
+    global motion_count
+    global last_motion
     global motions
-    # We need at least three point to calculate the slope of the lines.
-    if len(motions) < 3:
-        for motion in motions:
-            x = motion[-2]
-            y = motion[-1]
-            time = motion[0]
-            cmds.append("Settings.MoveMouseDelay = %f" %((time - time_of_last_command)/1000.0))
-            cmds.append("mouseMove(Location(%d,%d))"%(x,y))
-            time_of_last_command = time            
-        motions = []
-        return
-    # Get the x,y coordinates of the events
-    x_values = []
-    y_values = []
-    for motion in motions:
-        # print(motion)
-        x_values.append(motion[-2])
-        y_values.append(motion[-1])
-    # Find the events where the slope changes.
-    slope_indices = _get_slopes(x_values, y_values)
-    # Clean up the number by limiting the number of successive indices. The assumption is that there will be 
-    # an event per pixel move, and we want to cover some distance before adding a new mouse move command.
-    final_indices = [0]   # Always append start point
-    old_si = -1000000
-    for si in slope_indices:
-        if si - old_si > step_size:
-            final_indices.append(si)
-            old_si = si
-    final_indices.append(len(motions) - 1)      # Always append end point
-
-    # Create moveMouse commands for the end of straight lines.
-    for idx in final_indices:
-        motion = motions[idx]
-        x = motion[-2]
-        y = motion[-1]
-        time = motion[0]
-        cmds.append("Settings.MoveMouseDelay = %f" %((time - time_of_last_command)/1000.0))
-        cmds.append("mouseMove(Location(%d,%d))"%(x,y))
-        time_of_last_command = time
-    motions = []
+    if simplify_mode == "rdp":
+        motions.append(motion)
+        if len(motions) >= max_motions:
+            # The last point is always kept, so it can start the next chunk.
+            x_values = [m[-2] for m in motions]
+            y_values = [m[-1] for m in motions]
+            for idx in simplify.rdp(x_values, y_values, tolerance)[:-1]:
+                _move_mouse(motions[idx])
+            motions = motions[-1:]
+    elif motion_count == 0:
+        slope_filter.reset(precision, step_size)
+        slope_filter.add(motion[-2], motion[-1])
+        _move_mouse(motion)     # Always append start point
+    elif slope_filter.add(motion[-2], motion[-1]):
+        # The slope changed and we covered some distance since the previous mouseMove command.
+        _move_mouse(motion)
+    motion_count += 1
+    last_motion = motion
+
+def _handle_motions():
+    """ Adds the last moveMouse commands of the motion since the previous event. """
+    global motion_count
+    global last_motion
+    global motions
+    if stats.enabled and motion_count:
+        stats.observe("motion batch size", motion_count, "events")
+    if simplify_mode == "rdp":
+        if motions:
+            x_values = [motion[-2] for motion in motions]
+            y_values = [motion[-1] for motion in motions]
+            for idx in simplify.rdp(x_values, y_values, tolerance):
+                _move_mouse(motions[idx])
+            motions = []
+    elif motion_count > 1:
+        _move_mouse(last_motion)    # Always append end point
+    motion_count = 0
+    last_motion = None
 
+def _stop_snapping():
+    """ Stops taking snapshots of the last image when something other than motion happens: a click
+        on (or next to) the image, or any other button or key. Until then its commands are held. """
+    global start_snapping
+    if start_snapping:
+        stats.log("Turn off snapping")
+        # We are done hysterically saving the background image we are clicking on (or next to)
+        start_snapping = False
 
 def handle_mouse_buttons(time, press, buttonno, x, y):
     """ Handler for mouse button events. """
@@ -186,62 +208,53 @@ def handle_mouse_buttons(time, press, buttonno, x, y):
     global previous_event
     global left_shift_region
     global modifiers
-    global cmds
-    global start_snapping
     
     sp = [time, press, buttonno, x, y]
     mouse_movements.append([time, x, y])
     
     # We have something other than motion (a mouse button event), so we need to handle the motion.
     _handle_motions()
+    _stop_snapping()
 
     if press == "Release":
         if left_shift_region:
-            cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
+            cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
             # Create offset within the image created by pressing SHIFT while moving the mouse.
             if buttonno == 1:
-                cmds.append("hover(Location(%d, %d))"%(x,y))
+                cmds.append(commands.Hover(x, y))
                 dx = x - center_of_image[0]
                 dy = y - center_of_image[1]
-                cmds.append("click(Pattern(\"%s.png\").similar(0.9).targetOffset(%d,%d))"%(str(image_cnt - 1), dx,dy))
+                cmds.append(commands.Click(str(image_cnt - 1), dx, dy, region=_search_region(), wait=search_wait))
             elif buttonno == 3:
-                cmds.append("hover(Location(%d, %d))"%(x,y))
+                cmds.append(commands.Hover(x, y))
                 dx = x - center_of_image[0]
                 dy = y - center_of_image[1]
-                cmds.append("rightClick(Pattern(\"%s.png\").similar(0.9).targetOffset(%d,%d))"%(str(image_cnt - 1), dx,dy))
+                cmds.append(commands.Click(str(image_cnt - 1), dx, dy, right=True, region=_search_region(), wait=search_wait))
             left_shift_region = False
         else:
             if buttonno in [4,5]: # Handle mousewheel. TODO and linux?
-                no_of_clicks = 1
-                cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
-                # TODO The code below will combine several mouse wheel commands into one. (Delete the wait command in the line above) But it will loose the timing information
-                # if cmds and cmds[-1].startswith("wheel(%s, "%mouse_button_codes[buttonno]):
-                #     no_of_clicks = int(cmds[-1][len("wheel(%s, "%mouse_button_codes[buttonno]):-1])
-                #     no_of_clicks += 1
-                #     cmds = cmds[:-1]
-                cmds.append("wheel(%s, %d)" % (mouse_button_codes[buttonno], no_of_clicks))
+                cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
+                # Successive notches are combined into one wheel command by the optimizer.
+                cmds.append(commands.Wheel(mouse_button_codes[buttonno], 1))
             else:
-                cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
-                cmds.append("hover(Location(%d, %d))"%(x,y))
-                cmds.append("mouseUp(%s)"%(mouse_button_codes[buttonno]))   
+                cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
+                cmds.append(commands.Hover(x, y))
+                cmds.append(commands.MouseUp(mouse_button_codes[buttonno]))
         modifiers["button " + str(buttonno) + "down"] = False
     elif press == "Press":
         # Only create a mouseDown if it is not a mouse wheel action. # TODO: check this for windows.
         if not buttonno in [4, 5]:
-            if buttonno == 1:
-                print("Turn off snapping")
-                # We are done hysterically saving the background image we are clicking on (or next to)
-                start_snapping = False
             modifiers["button " + str(buttonno) + "down"] = True
             if not left_shift_region:
-                cmds.append("hover(Location(%d, %d))"%(x,y))
-                cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
-                cmds.append("mouseDown(%s)"%(mouse_button_codes[buttonno]))
+                cmds.append(commands.Hover(x, y))
+                cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
+                cmds.append(commands.MouseDown(mouse_button_codes[buttonno]))
     if not (buttonno in [4,5] and press == "Press"):
         # Not for the press event of the mouse wheel, because then the wait time is always 0
         time_of_last_command = time 
     previous_event = sp
     mouse_moved = False   
+    _release()
 
 def handle_mouse_motion(time, x, y):
     global mouse_moved
@@ -254,13 +267,16 @@ def handle_mouse_motion(time, x, y):
     mouse_movements.append(sp) 
     if start_snapping and ((x - coordinates[0])%20 > 15 or (y - coordinates[1])%20 > 15):
         # (x - coordinates[0])%20 > 15 is not exactly fail proof, but it ensures that not every miniature movement results in saving a screenshot and thus increasing the event queue because the program can't keep up.
-        screenshot = ImageGrab.grab(coordinates)
-        screenshot.save(fname, format="png")     
+        # A pending snapshot of the same file is replaced by this one.
+        if capture_images:
+            capture_worker.request(fname, coordinates)
 
-    # We only store a list of motion events for later processing.
-    motions.append(sp)
+    _add_motion(sp)
     mouse_moved = True
     previous_event = sp  
+    if motion_count % release_interval == 0:
+        # The mouseMove commands are passed on in batches, the other handlers pass everything on.
+        _release()
 
 def handle_keys(time, press, char, x, y):
     global mouse_moved
@@ -271,7 +287,6 @@ def handle_keys(time, press, char, x, y):
     global left_shift_region
     global center_of_image
     global image_cnt
-    global cmds
     global current_cmds_length
     global coordinates
     global fname
@@ -281,6 +296,7 @@ def handle_keys(time, press, char, x, y):
 
     # We have something other than motion (a mouse button event), so we need to handle the motion.
     _handle_motions()
+    _stop_snapping()
 
     if press == "Release":
         # Handle key presses
@@ -290,33 +306,31 @@ def handle_keys(time, press, char, x, y):
             if not key_pressed_while_holding_ctrl_or_shift and previous_char[2] == "Control_L":
                 if mouse_moved:
                     # A region was selected. Highlight it.
-                    no_to_remove = len(cmds) - current_cmds_length
-                    cmds = cmds[:-no_to_remove]
-                    cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
+                    cmds.rollback(current_cmds_length)
+                    cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
                     old_x = previous_char[-2]
                     old_y = previous_char[-1]
                     w = abs(old_x - x)
                     h = abs(old_y - y)
                     x1 = min(old_x, x)
                     y1 = min(old_y, y)
-                    cmds.append("reg = Region(%d, %d, %d, %d)" %(x1, y1, w, h))
+                    cmds.append(commands.Region(x1, y1, w, h))
                     seconds = 2.0
                     color = "#FF0000"
-                    cmds.append("reg.highlight(%d, \"%s\")" % (seconds, color))
+                    cmds.append(commands.Highlight(seconds, color))
                 else:
-                    cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
+                    cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
                     # The button was pressed but never combined with another key and the mouse never moved
-                    cmds.append("# mark_point(Location(%d, %d))" % (x, y))
+                    cmds.append(commands.Comment("mark_point(Location(%d, %d))" % (x, y)))
                 time_of_last_command = time
                 previous_char = previous_event = sp                        
         if char == "Shift_L":
             if not key_pressed_while_holding_ctrl_or_shift and previous_char[2] == "Shift_L":
-                cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
+                cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
                 if mouse_moved:
                     # A region was selected while holding SHIFT (but no clicking). Take a snapshot.
-                    no_to_remove = len(cmds) - current_cmds_length
-                    cmds = cmds[:-no_to_remove]
-                    cmds.append("wait(%f)"%((time - time_of_last_command)/1000.0))
+                    cmds.rollback(current_cmds_length)
+                    cmds.append(commands.Wait(_seconds(time - time_of_last_command)))
                     old_x = previous_char[-2]
                     old_y = previous_char[-1]
                     try:
@@ -331,11 +345,11 @@ def handle_keys(time, press, char, x, y):
                             old_y = tmp
                         coordinates = bbox=(old_x, old_y, x, y)
                         start_snapping = True
-                        screenshot = ImageGrab.grab(bbox=(old_x, old_y, x, y))
-                        screenshot.save(fname, format="png")
+                        if capture_images:
+                            capture_worker.request(fname, coordinates)
                         left_shift_region = True
-                        cmds.append("# wait(\"%s\")" % (str(image_cnt) + ".png"))   # This type of wait will throw off the timing
-                        center_of_image = [int((x + old_x)/2.0), int((y - old_y)/2.0)]
+                        cmds.append(commands.ImageWait(str(image_cnt)))   # This type of wait will throw off the timing
+                        center_of_image = [int((x + old_x)/2.0), int((y + old_y)/2.0)]
                     except Exception as e: 
                         print(e)
                         print("Unable to generate: " + fname)
@@ -344,12 +358,13 @@ def handle_keys(time, press, char, x, y):
                 time_of_last_command = time
                 previous_char = previous_event = sp                        
         if not key_is_modifier:            
-            if char in special_chars:
-                char = special_chars[char]
-            t = 0.0
+            info = keymap.keys.get(char)
+            if info and info.char:
+                char = info.char
+            t = _seconds(0)
             if previous_char == previous_event and previous_char:
-                t = (time - previous_char[0]) / 1000
-            cmds.append("Settings.TypeDelay = " + str(t))
+                t = _seconds(time - previous_char[0])
+            cmds.append(commands.Setting("TypeDelay", t))
 
             modify = ""
             if modifiers["left alt down"]:
@@ -362,8 +377,9 @@ def handle_keys(time, press, char, x, y):
             elif modifiers["left shift down"] or modifiers["right shift down"]:
                 if modifiers["left shift down"]:
                     key_pressed_while_holding_ctrl_or_shift = True
-                if char in ",./;'\\[]`1234567890-=<":
-                    char = shift_chars[keyboard_layout][char]
+                shifted = shift_chars[keyboard_layout].get(char)
+                if shifted:
+                    char = shifted
                 else:
                     modify += "+Key.SHIFT"
             elif modifiers["left windows down"] or modifiers["right windows down"]:
@@ -373,46 +389,145 @@ def handle_keys(time, press, char, x, y):
             if modify:
                 modify = modify[1:]
 
-            if not char in ["Return", "Escape", "Tab", "BackSpace", "Delete", "F1", "F2", "F3", "F4", 
-                            "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "F13", "F14", "F15", "Insert", 
-                            "space", "Home", "End", "Left", "Right", "Down", "Up", "Next", "Page_Up", "Print", 
-                            "Pause", "Caps_Lock", "Scroll_Lock", "Num_Lock", "KP_Insert", "KP_End", "KP_Down", 
-                            "KP_Next", "KP_Left", "KP_Begin", "KP_Right", "KP_Home", "KP_Up", "KP_Page_Up", 
-                            "KP_Delete", "KP_Add", "KP_Subtract", "KP_Multiply", "KP_Divide", "KP_Enter"]:
-                if modify:
-                    cmds.append("type(\"%s\", %s)" % (char, modify))
-                else:
-                    cmds.append("type(\"%s\")" % char)
+            if info is None or info.sikulix is None:
+                cmds.append(commands.Type(char, modify))
             else:
-                sikulixkey = "Key." + sikulixkeys[char]
-                if modify:
-                    cmds.append("type(%s, %s)" % (sikulixkey, modify))
-                else:
-                    cmds.append("type(%s)" % sikulixkey)
+                cmds.append(commands.Type(info.sikulix, modify, key=True))
             time_of_last_command = time
             previous_char = previous_event = sp
     elif press == "Press":
         key_is_modifier = _set_modifiers(char, True)
         if (char == "Shift_L" and not modifiers["left control down"]) or (char == "Control_L" and not modifiers["left shift down"]):
-            current_cmds_length = len(cmds)
+            current_cmds_length = cmds.savepoint()
             previous_char = sp
             key_pressed_while_holding_ctrl_or_shift = False
     mouse_moved = False        
+    _release()
                         
 def clean_up():
+    global start_snapping
+    global script_writer
     # We have something other than motion (a mouse button event), so we need to handle the motion.
     _handle_motions()
+    # Wait for the images that are still being grabbed or saved.
+    capture_worker.flush()
+    # Encode the images that were kept as pixels while recording.
+    capture_worker.encode()
+    # No more snapshots, every command is final now.
+    start_snapping = False
+    cmds.release(None, _finish_image)
+    if optimize_commands and cmds.output is None:
+        cmds.final = list(commands.optimize(cmds.final, max_type_delay, max_wheel_gap, max_idle))
+    if script_writer:
+        script_writer.close()
+        script_writer = None
+
+def write_script(filename, trim=False):
+    """ Writes the commands to the Sikulix script filename while recording, instead of keeping them
+        in cmds.final. clean_up() closes the file. With trim the Enter that started the recorder and
+        the Esc that stopped it are left out. """
+    global script_writer
+    script_writer = script.ScriptWriter(filename, optimize_commands, max_type_delay, max_wheel_gap, trim, max_idle)
+    cmds.output = script_writer.write
+
+def _release():
+    """ Passes the commands that can't change anymore on. While holding left SHIFT or CTRL the
+        commands after current_cmds_length may still be replaced by a region command. """
+    if modifiers["left shift down"] or modifiers["left control down"]:
+        cmds.release(current_cmds_length, _finish_image)
+    else:
+        cmds.release(None, _finish_image)
+
+def _finish_image(command):
+    """ Called before a command is released. Returns False for a click on, or wait for, an image
+        that is still being grabbed. Otherwise sets the offset and similarity of the clicks on
+        images that were cropped by the capture worker, and makes the commands refer to the file
+        with the same pixels, for the images that were not saved because an identical image was
+        already on disk. """
+    if not capture_images or not isinstance(command, (commands.Click, commands.ImageWait)):
+        return True
+    image = output_folder + command.image + ".png"
+    if (start_snapping and image == fname) or not capture_worker.done(image):
+        return False
+    info = capture_worker.pattern(image)
+    if info and isinstance(command, commands.Click):
+        # The offset was from the center of the region selected while recording.
+        left, top, right, bottom = info.region
+        command.dx += int((left + right)/2.0) - int((info.crop[0] + info.crop[2])/2.0)
+        command.dy += int((top + bottom)/2.0) - int((info.crop[1] + info.crop[3])/2.0)
+        command.similarity = info.similarity
+    command.image = os.path.basename(capture_worker.alias(image))[:-4]
+    return True
+
+def handle_event(time, kind, code, x, y):
+    """ Calls the handler of a raw event (see event_log). Returns False if the event isn't handled. """
+    if time_of_last_command is None:
+        handle_first_time(time)
+    if kind == event_log.MOTION:
+        handle_mouse_motion(time, x, y)
+    elif kind == event_log.KEY_PRESS:
+        handle_keys(time, "Press", code, x, y)
+    elif kind == event_log.KEY_RELEASE:
+        handle_keys(time, "Release", code, x, y)
+    elif kind == event_log.BUTTON_PRESS:
+        handle_mouse_buttons(time, "Press", code, x, y)
+    elif kind == event_log.BUTTON_RELEASE:
+        handle_mouse_buttons(time, "Release", code, x, y)
+    else:
+        # Unknown key codes are not handled when recording either.
+        return False
+    return True
+
+def convert(events):
+    """ Generator that converts recorded events to Sikulix commands without a display.
+        events are lines in the text form of record_events (or event_log.Event tuples). They are
+        fed through the same handlers as a live recording. The lines of the script are yielded as
+        soon as they are final. No images are grabbed, the Pattern("N.png") commands refer to the
+        images already stored in output_folder by the original recording. """
+    stream = _convert(events)
+    if optimize_commands:
+        stream = commands.optimize(stream, max_type_delay, max_wheel_gap, max_idle)
+    for command in stream:
+        yield str(command)
+
+def _convert(events):
+    """ Yields the commands of convert(), not yet optimized. """
+    global capture_images
+    reset()
+    released = deque()
+    cmds.output = released.append
+    old_capture_images = capture_images
+    capture_images = False
+    try:
+        for event in events:
+            if isinstance(event, str):
+                event = event_log.parse_event(event)
+            handle_event(*event)
+            while released:
+                yield released.popleft()
+        clean_up()
+        while released:
+            yield released.popleft()
+    finally:
+        capture_images = old_capture_images
 
 if __name__ == "__main__":
+    import sys
+    import journal
 
-    # TODO: Create a for loop to handle events from a file for unit testing.
-    filename = "/tmp/eventrecord.txt"
-    myeventlist = [] 
-    with open(filename[:-3] + "json", "r") as file:
-        myeventlist = json.load(file)
+    # Usage: python code_events.py [<eventrecord.json|.txt|.ndjson> [<script.py>]]
+    filename = len(sys.argv) > 1 and sys.argv[1] or "/tmp/eventrecord.json"
+    output = len(sys.argv) > 2 and sys.argv[2] or "/tmp/test.sikuli/test.py"
+    output_folder = os.path.dirname(os.path.abspath(output)) + os.path.sep
+    if filename.endswith(".ndjson"):
+        myeventlist = journal.read_journal(filename)
+    elif filename.endswith(".json"):
+        with open(filename, "r") as file:
+            myeventlist = json.load(file)
+    else:
+        myeventlist = open(filename, "r", encoding="utf-8")
 
-    code, mouse_movements = convert(myeventlist)
-    f = open("/tmp/test.sikuli/test.py", "w", encoding="utf-8")
-    for r in code:
+    f = open(output, "w", encoding="utf-8")
+    for r in convert(myeventlist):
         f.write(r + "\n")
-    f.close()
\ No newline at end of file
+    f.close()
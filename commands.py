@@ -0,0 +1,308 @@
+#!/usr/env python
+#
+# The Sikulix commands generated by code_events. Every command is an
+# object that prints as one line of the script, so the list of commands
+# can be optimized before it is written.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+
+class Wait:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __str__(self):
+        return "wait(%f)" % self.seconds
+
+
+class Setting:
+    """ An assignment to Settings, e.g. Settings.MoveMouseDelay = 0.5 """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __str__(self):
+        if self.name == "TypeDelay":
+            return "Settings.TypeDelay = " + str(round(self.value, 6))
+        return "Settings.%s = %f" % (self.name, self.value)
+
+
+class MouseMove:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __str__(self):
+        return "mouseMove(Location(%d,%d))" % (self.x, self.y)
+
+
+class Hover:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __str__(self):
+        return "hover(Location(%d, %d))" % (self.x, self.y)
+
+
+class MouseDown:
+    def __init__(self, button):
+        self.button = button        # e.g. "Button.LEFT"
+
+    def __str__(self):
+        return "mouseDown(%s)" % self.button
+
+
+class MouseUp:
+    def __init__(self, button):
+        self.button = button
+
+    def __str__(self):
+        return "mouseUp(%s)" % self.button
+
+
+class Wheel:
+    def __init__(self, button, steps=1):
+        self.button = button        # "Button.WHEEL_UP" or "Button.WHEEL_DOWN"
+        self.steps = steps
+
+    def __str__(self):
+        return "wheel(%s, %d)" % (self.button, self.steps)
+
+
+class Type:
+    """ Types text, or a Sikulix key constant (e.g. "Key.ENTER") if key is True.
+        modifiers is a Sikulix expression like "Key.CTRL", or "" for none. """
+
+    def __init__(self, text, modifiers="", key=False):
+        self.text = text
+        self.modifiers = modifiers
+        self.key = key
+
+    def __str__(self):
+        text = self.key and self.text or "\"%s\"" % self.text
+        if self.modifiers:
+            return "type(%s, %s)" % (text, self.modifiers)
+        return "type(%s)" % text
+
+
+class Click:
+    """ Clicks on an image stored while holding left SHIFT, at an offset from its center.
+        region (x, y, w, h) is where the image is searched for first, for wait seconds,
+        before the whole screen is searched. None to search the whole screen. """
+
+    def __init__(self, image, dx, dy, right=False, region=None, wait=1, similarity=0.9):
+        self.image = image          # The name of the image without .png
+        self.dx = dx
+        self.dy = dy
+        self.right = right
+        self.region = region
+        self.wait = wait
+        self.similarity = similarity
+
+    def __str__(self):
+        pattern = "Pattern(\"%s.png\").similar(%s).targetOffset(%d,%d)" % (self.image, self.similarity, self.dx, self.dy)
+        if self.region:
+            pattern = "Region(%d, %d, %d, %d).exists(%s, %s) or %s" % (self.region + (pattern, self.wait, pattern))
+        return "%s(%s)" % (self.right and "rightClick" or "click", pattern)
+
+
+class ImageWait:
+    """ wait() for an image stored while holding left SHIFT. Commented out, it would throw off the timing. """
+
+    def __init__(self, image):
+        self.image = image
+
+    def __str__(self):
+        return "# wait(\"%s.png\")" % self.image
+
+
+class Region:
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def __str__(self):
+        return "reg = Region(%d, %d, %d, %d)" % (self.x, self.y, self.w, self.h)
+
+
+class Highlight:
+    def __init__(self, seconds, color):
+        self.seconds = seconds
+        self.color = color
+
+    def __str__(self):
+        return "reg.highlight(%d, \"%s\")" % (self.seconds, self.color)
+
+
+class Comment:
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return "# " + self.text
+
+
+def optimize(commands, max_type_delay=1.0, max_wheel_gap=0.5, max_wait=None):
+    """ Peephole optimizer. Generator that yields the commands with:
+        - runs of single keystrokes folded into one type() with the mean delay between the keys,
+          a run ends at a pause longer than max_type_delay seconds,
+        - successive notches of the mouse wheel less than max_wheel_gap seconds apart combined
+          into one wheel() call,
+        - Settings that are overwritten before they are used and hovers to where the mouse
+          already is dropped,
+        - successive waits merged and empty waits dropped.
+        The total of the waits stays the same, except that no merged wait is longer than max_wait
+        seconds (None for no limit). """
+    commands = _fold_typing(commands, max_type_delay)
+    commands = _drop_redundant(commands)
+    commands = _coalesce_wheel(commands, max_wheel_gap)
+    return _merge_waits(commands, max_wait)
+
+
+def _plain_text(command):
+    """ Returns the text typed by a keystroke without modifiers, None for other commands.
+        An unmodified Key.SPACE types a space. """
+    if not isinstance(command, Type) or command.modifiers:
+        return None
+    if not command.key:
+        return command.text
+    if command.text == "Key.SPACE":
+        return " "
+    return None
+
+
+def _fold_typing(commands, max_type_delay):
+    """ Settings.TypeDelay = d0, type("h"), Settings.TypeDelay = d1, type("i") becomes
+        wait(d0), Settings.TypeDelay = d1, type("hi"). """
+    run = []            # (delay, Type) of the keystrokes in the current run
+    delay = None        # The TypeDelay setting waiting for its type()
+
+    def flush():
+        if len(run) == 1:
+            yield Setting("TypeDelay", run[0][0])
+            yield run[0][1]
+        elif run:
+            if run[0][0]:
+                yield Wait(run[0][0])
+            delays = [d for d, command in run[1:]]
+            yield Setting("TypeDelay", round(sum(delays) / len(delays), 3))
+            yield Type("".join(_plain_text(command) for d, command in run))
+        del run[:]
+
+    for command in commands:
+        if delay is not None:
+            if _plain_text(command) is not None:
+                if run and delay.value > max_type_delay:
+                    for c in flush():
+                        yield c
+                run.append((delay.value, command))
+                delay = None
+                continue
+            for c in flush():
+                yield c
+            yield delay
+            delay = None
+        if isinstance(command, Setting) and command.name == "TypeDelay":
+            delay = command
+            continue
+        for c in flush():
+            yield c
+        yield command
+    for c in flush():
+        yield c
+    if delay is not None:
+        yield delay
+
+
+def _coalesce_wheel(commands, max_wheel_gap):
+    """ wheel(UP, 1), wait(0.1), wheel(UP, 1) becomes wheel(UP, 2), wait(0.1) """
+    wheel = None        # The wheel command steps are added to
+    waits = []          # The waits after it
+    skipped = 0.0       # The waits between the combined steps
+
+    def flush():
+        if wheel:
+            yield wheel
+            if skipped:
+                yield Wait(skipped)
+        for wait in waits:
+            yield wait
+        del waits[:]
+
+    for command in commands:
+        if isinstance(command, Wheel):
+            gap = sum(wait.seconds for wait in waits)
+            if wheel and wheel.button == command.button and gap <= max_wheel_gap:
+                wheel.steps += command.steps
+                skipped += gap
+                del waits[:]
+                continue
+            for c in flush():
+                yield c
+            wheel = Wheel(command.button, command.steps)
+            skipped = 0.0
+        elif wheel and isinstance(command, Wait):
+            waits.append(command)
+        else:
+            for c in flush():
+                yield c
+            wheel = None
+            yield command
+    for c in flush():
+        yield c
+
+
+def _merge_waits(commands, max_wait=None):
+    seconds = 0.0
+    for command in commands:
+        if isinstance(command, Wait):
+            seconds += command.seconds
+            continue
+        if seconds > 0:
+            yield Wait(_limit(seconds, max_wait))
+            seconds = 0.0
+        yield command
+    if seconds > 0:
+        yield Wait(_limit(seconds, max_wait))
+
+
+def _limit(seconds, max_wait):
+    if max_wait is not None and seconds > max_wait:
+        return max_wait
+    return seconds
+
+
+def _drop_redundant(commands):
+    settings = []       # Settings not yet followed by another command
+    current = {}        # The value of the settings that keep their value, like MoveMouseDelay.
+    position = None     # Where the mouse is, None if unknown.
+    for command in commands:
+        if isinstance(command, Setting):
+            # Overwritten before it is used.
+            settings = [setting for setting in settings if setting.name != command.name]
+            settings.append(command)
+            continue
+        for setting in settings:
+            if setting.name == "MoveMouseDelay":
+                if current.get(setting.name) == setting.value:
+                    continue
+                current[setting.name] = setting.value
+            yield setting
+        settings = []
+        if isinstance(command, Hover):
+            if position == (command.x, command.y):
+                continue
+            position = (command.x, command.y)
+        elif isinstance(command, MouseMove):
+            position = (command.x, command.y)
+        elif isinstance(command, Click):
+            position = None
+        yield command
+    for setting in settings:
+        yield setting
@@ -0,0 +1,88 @@
+#!/usr/env python
+#
+# Hands the events of the keyboard and mouse listeners to a single thread
+# that calls the code handlers. The listeners only append to a queue, so
+# a slow handler doesn't delay the hooks of the operating system and the
+# handlers are never called by two threads at the same time.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class Dispatcher:
+    """ Calls handlers on one consumer thread in the order of the time stamps of the events.
+        Events of different listeners are merged by time stamp: an event is kept for
+        reorder_window seconds, so an older event of the other listener can still go first. """
+
+    def __init__(self, reorder_window=0.005):
+        self.reorder_window = reorder_window
+        self.dispatched = 0
+        self.max_depth = 0          # The maximum number of events waiting to be handled.
+        self.max_lag = 0.0          # The maximum time in seconds between posting and handling an event.
+        self._incoming = deque()    # append() and popleft() are atomic, no lock needed.
+        self._wakeup = threading.Event()
+        self._sequence = itertools.count()
+        self._waiting = []          # heap of (time, sequence, posted, handler, args)
+        self._stopping = False
+        self._thread = None
+
+    def post(self, time_stamp, handler, *args):
+        """ Called by the listeners. Queues handler(*args) for the event with time_stamp (ms). """
+        self._incoming.append((time_stamp, next(self._sequence), time.monotonic(), handler, args))
+        self._wakeup.set()
+
+    def depth(self):
+        """ Returns the number of events waiting to be handled. """
+        return len(self._incoming) + len(self._waiting)
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Handles all events that are still queued and stops the consumer thread. """
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        return "Dispatched %d events, max queue depth %d, max dispatch lag %.1f ms." % (
+            self.dispatched, self.max_depth, self.max_lag * 1000.0)
+
+    def _run(self):
+        waiting = self._waiting
+        incoming = self._incoming
+        while True:
+            if waiting:
+                self._wakeup.wait(max(0.0, waiting[0][2] + self.reorder_window - time.monotonic()))
+            else:
+                self._wakeup.wait()
+            self._wakeup.clear()
+            stopping = self._stopping
+            while incoming:
+                heapq.heappush(waiting, incoming.popleft())
+            if len(waiting) > self.max_depth:
+                self.max_depth = len(waiting)
+            now = time.monotonic()
+            while waiting and (stopping or waiting[0][2] + self.reorder_window <= now):
+                time_stamp, sequence, posted, handler, args = heapq.heappop(waiting)
+                lag = time.monotonic() - posted
+                if lag > self.max_lag:
+                    self.max_lag = lag
+                try:
+                    handler(*args)
+                except Exception as e:
+                    print("Error while handling event at %d: %s" % (time_stamp, e))
+                self.dispatched += 1
+            if stopping and not incoming and not waiting:
+                return
@@ -0,0 +1,102 @@
+#!/usr/env python
+#
+# Compact storage of the raw events received by the recorders.
+# The events are stored in typed arrays instead of one string per event,
+# the text form is only created when the log is read.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import threading
+from array import array
+from collections import namedtuple
+
+# Kinds of events. The names are used in the text form.
+MOTION = 0
+KEY_PRESS = 1
+KEY_RELEASE = 2
+BUTTON_PRESS = 3
+BUTTON_RELEASE = 4
+KEYCODE_PRESS = 5
+KEYCODE_RELEASE = 6
+
+kind_names = {MOTION: ("Motion", None), KEY_PRESS: ("Key", "Press"), KEY_RELEASE: ("Key", "Release"),
+              BUTTON_PRESS: ("Button", "Press"), BUTTON_RELEASE: ("Button", "Release"),
+              KEYCODE_PRESS: ("KeyCode", "Press"), KEYCODE_RELEASE: ("KeyCode", "Release")}
+kinds_by_name = dict((names, kind) for kind, names in kind_names.items())
+
+# code is the name of the key for KEY_PRESS and KEY_RELEASE, the button number for buttons,
+# the key code for KEYCODE_PRESS and KEYCODE_RELEASE and 0 for motion.
+Event = namedtuple("Event", ["time", "kind", "code", "x", "y"])
+
+
+def format_event(time, kind, code, x, y):
+    """ Returns the tab separated text form of an event: [timestamp in ms, action, details] """
+    if kind == MOTION:
+        return "%d\tMotion\t%d\t%d" % (time, x, y)
+    name, press = kind_names[kind]
+    return "%d\t%s\t%s\t%s\t%d\t%d" % (time, name, press, code, x, y)
+
+
+def parse_event(line):
+    """ Returns the Event of a line in the text form created by format_event. """
+    fields = line.rstrip("\r\n").split("\t")
+    if fields[1] == "Motion":
+        return Event(int(fields[0]), MOTION, 0, int(fields[2]), int(fields[3]))
+    kind = kinds_by_name[(fields[1], fields[2])]
+    code = fields[3]
+    if kind != KEY_PRESS and kind != KEY_RELEASE:
+        code = int(code)
+    return Event(int(fields[0]), kind, code, int(fields[4]), int(fields[5]))
+
+
+class EventLog:
+    """ Append only log of events stored column wise in arrays of integers.
+        Key names are interned, so every key event only stores an index.
+        Iterating over the log yields the text form of the events. Events can be appended from
+        more than one thread. """
+
+    def __init__(self):
+        self.times = array("q")
+        self.kinds = array("b")
+        self.codes = array("i")
+        self.xs = array("i")
+        self.ys = array("i")
+        self.names = []             # Interned key names, the code of a key event is an index in this list.
+        self._name_index = {}
+        self._lock = threading.Lock()   # Keeps the fields of an event in the same row.
+
+    def append(self, time, kind, code, x, y):
+        """ Adds an event. code is a key name for key events and an integer otherwise. """
+        with self._lock:
+            if kind == KEY_PRESS or kind == KEY_RELEASE:
+                index = self._name_index.get(code)
+                if index is None:
+                    index = self._name_index[code] = len(self.names)
+                    self.names.append(code)
+                code = index
+            self.times.append(time)
+            self.kinds.append(kind)
+            self.codes.append(code)
+            # The coordinates are floats on some platforms.
+            self.xs.append(int(x))
+            self.ys.append(int(y))
+
+    def clear(self):
+        self.__init__()
+
+    def events(self):
+        """ Yields the events as Event tuples. """
+        names = self.names
+        for time, kind, code, x, y in zip(self.times, self.kinds, self.codes, self.xs, self.ys):
+            if kind == KEY_PRESS or kind == KEY_RELEASE:
+                code = names[code]
+            yield Event(time, kind, code, x, y)
+
+    def __iter__(self):
+        for event in self.events():
+            yield format_event(*event)
+
+    def __len__(self):
+        return len(self.times)
@@ -0,0 +1,99 @@
+#!/usr/env python
+#
+# Passes the events of the listener threads to an asyncio event loop.
+# The listeners append to a bounded queue. The loop is only woken up
+# when the queue was empty, and then takes all queued events at once,
+# so a fast mouse doesn't cost one wake-up per event.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import asyncio
+import threading
+from collections import deque
+
+
+class EventStream:
+    """ Async iterator over the items put() by other threads, see Recorder.events().
+        At most maxsize items are queued. When the queue is full, overflow decides:
+        "drop-oldest" drops the oldest item (counted in dropped), "block" makes put()
+        wait until the loop has taken the queued items. Never put() from the loop itself
+        in "block" mode. The iteration ends after close(), when all items are taken. """
+
+    def __init__(self, loop, maxsize=1024, overflow="drop-oldest"):
+        if overflow not in ("drop-oldest", "block"):
+            raise ValueError("overflow must be 'drop-oldest' or 'block', not %r" % overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.wakeups = 0
+        self._loop = loop
+        self._items = deque()       # Filled by the other threads
+        self._batch = deque()       # Emptied by the loop
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._wakeup = asyncio.Event()
+        self._scheduled = False     # True while the loop has been, or will be, woken up.
+        self._closed = False
+
+    def put(self, item):
+        """ Called by the other threads. Returns False if the stream is closed. """
+        with self._lock:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.overflow == "block":
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._space.wait()
+                    if self._closed:
+                        return False
+                else:
+                    self._items.popleft()
+                    self.dropped += 1
+            self._items.append(item)
+            if self._scheduled:
+                return True
+            self._scheduled = True
+        self._wake()
+        return True
+
+    def close(self):
+        """ Ends the iteration after the queued items. Can be called from any thread. """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._space.notify_all()
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._wake()
+
+    def _wake(self):
+        self.wakeups += 1
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The loop is closed, nobody is listening anymore.
+            with self._lock:
+                self._closed = True
+                self._space.notify_all()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._batch:
+            with self._lock:
+                if self._items:
+                    self._batch, self._items = self._items, deque()
+                    self._space.notify_all()
+                    break
+                if self._closed:
+                    raise StopAsyncIteration
+                # Empty, the next put() wakes us up.
+                self._scheduled = False
+                self._wakeup.clear()
+            await self._wakeup.wait()
+        return self._batch.popleft()
@@ -0,0 +1,101 @@
+#!/usr/env python
+#
+# Append only journal of the recorded events on disk.
+# A background thread writes the events in batches, so a crash or a lost
+# X connection doesn't lose the recording and memory doesn't grow with the
+# length of the session. The file can be read while recording.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import json
+import os
+import queue
+import threading
+import time
+import event_log
+
+# Every line of the journal is a JSON array with the fields of the text form of an event, e.g.
+# [1715865600123, "Motion", 10, 20] or [1715865600456, "Key", "Press", "a", 10, 20]
+
+
+def _to_json(time, kind, code, x, y):
+    if kind == event_log.MOTION:
+        return json.dumps([time, "Motion", int(x), int(y)])
+    name, press = event_log.kind_names[kind]
+    return json.dumps([time, name, press, code, int(x), int(y)])
+
+
+def read_journal(filename):
+    """ Yields the events of a journal as event_log.Event tuples.
+        A last line that was only partially written (the recorder was killed) is skipped. """
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                break
+            if fields[1] == "Motion":
+                yield event_log.Event(fields[0], event_log.MOTION, 0, fields[2], fields[3])
+            else:
+                yield event_log.Event(fields[0], event_log.kinds_by_name[(fields[1], fields[2])], fields[3], fields[4], fields[5])
+
+
+class Journal:
+    """ Writes events to an NDJSON file on a background thread.
+        At most max_pending events are buffered, append() blocks when the writer can't keep up.
+        The file is flushed after every batch and synced to disk every sync_interval seconds. """
+
+    def __init__(self, filename, batch_size=1024, max_pending=65536, sync_interval=1.0):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.written = 0
+        self._queue = queue.Queue(max_pending)
+        self._file = open(filename, "w", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def append(self, time, kind, code, x, y):
+        """ Queue an event. code is a key name for key events, see event_log. """
+        self._queue.put((time, kind, code, x, y))
+
+    def close(self):
+        """ Writes all queued events, syncs the file and stops the writer. """
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+    def _run(self):
+        last_sync = time.monotonic()
+        done = False
+        while not done:
+            try:
+                event = self._queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                event = ()
+            lines = []
+            while event is not None:
+                if event:
+                    lines.append(_to_json(*event))
+                if len(lines) >= self.batch_size:
+                    break
+                try:
+                    event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            done = event is None
+            if lines:
+                lines.append("")
+                self._file.write("\n".join(lines))
+                self._file.flush()
+                self.written += len(lines) - 1
+            now = time.monotonic()
+            if done or now - last_sync >= self.sync_interval:
+                os.fsync(self._file.fileno())
+                last_sync = now
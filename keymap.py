@@ -0,0 +1,80 @@
+#!/usr/env python
+#
+# Translation tables for keys, shared by the recorders and code_events.
+# All tables are built once at import, so translating a key is a single
+# dictionary lookup.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+from collections import namedtuple
+
+# pynput is not imported here, it isn't needed for Xlib or to convert a recording offline.
+# record_events calls load_pynput_keys().
+keyboard = None
+
+# name: the canonical name of the key, as stored in the event log and passed to the handlers.
+# char: the character to type for the key, None if it isn't a character.
+# sikulix: the Sikulix constant to type for the key (e.g. "Key.ENTER"), None if there is none.
+# modifier: the entry in code_events.modifiers that is set while the key is held down, None if it isn't a modifier.
+KeyInfo = namedtuple("KeyInfo", ["name", "char", "sikulix", "modifier"])
+
+# Sikulix keys by the name of the key in Xlib
+_xlib_keys = {"Return":"ENTER", "Escape":"ESC", "Tab":"TAB", "BackSpace":"BACKSPACE",
+              "Delete": "DELETE", "F1":"F1", "F2":"F2", "F3":"F3", "F4":"F4",
+              "F5":"F5", "F6":"F6", "F7":"F7", "F8":"F8", "F9":"F9", "F10":"F10",
+              "F11":"F11", "F12":"F12", "F13":"F13", "F14":"F14", "F15":"F15",
+              "Insert": "INSERT", "space": "SPACE", "Home": "HOME", "End":"END",
+              "Left":"LEFT", "Right":"RIGHT", "Down":"DOWN", "Up":"UP", "Next":"PAGE_DOWN",
+              "Page_Up":"PAGE_UP", "Print":"PRINTSCREEN", "Pause":"PAUSE",
+              "Caps_Lock":"CAPS_LOCK", "Scroll_Lock":"SCROLL_LOCK", "Num_Lock":"NUM_LOCK",
+              "KP_Insert":"NUM0", "KP_End":"NUM1", "KP_Down":"NUM2", "KP_Next":"NUM3",
+              "KP_Left":"NUM4", "KP_Begin":"NUM5", "KP_Right":"NUM6",
+              "KP_Home":"NUM7", "KP_Up":"NUM8", "KP_Page_Up":"NUM9", "KP_Delete":"SEPARATOR",
+              "KP_Add":"ADD", "KP_Subtract":"MINUS", "KP_Multiply":"MULTIPLY",
+              "KP_Divide":"DIVIDE", "KP_Enter": "ENTER"}
+# Sikulix keys by the name of the key in pynput
+_pynput_keys = {"enter":"ENTER", "esc":"ESC", "tab":"TAB", "backspace":"BACKSPACE",
+                "delete": "DELETE", "f1":"F1", "f2":"F2", "f3":"F3", "f4":"F4",
+                "f5":"F5", "f6":"F6", "f7":"F7", "f8":"F8", "f9":"F9", "f10":"F10",
+                "f11":"F11", "f12":"F12", "f13":"F13", "f14":"F14", "f15":"F15",
+                "insert": "INSERT", "space": "SPACE", "home": "HOME", "end":"END",
+                "left":"LEFT", "right":"RIGHT", "down":"DOWN", "up":"UP", "page_down":"PAGE_DOWN",
+                "page_up":"PAGE_UP", "print_screen":"PRINTSCREEN", "pause":"PAUSE",
+                "caps_lock":"CAPS_LOCK", "scroll_lock":"SCROLL_LOCK", "num_lock":"NUM_LOCK",
+                "<65437>":"NUM5"}
+# Needed when using xlib instead of pynput
+_special_chars = {"comma":",", "period":".", "slash":"/", "semicolon":";", "apostrophe":"'", "backslash":"\\",
+                  "bracketleft":"[", "bracketright":"]", "grave":"`", "minus":"-", "equal":"=",}
+_modifiers = {"Control_L": "left control down", "Shift_L": "left shift down", "Alt_L": "left alt down",
+              "Super_L": "left windows down", "Control_R": "right control down", "Shift_R": "right shift down",
+              "Alt_R": "right alt down", "Super_R": "right windows down", "Menu": "context menu down"}
+
+# All keys that are not typed as themselves, by canonical name.
+keys = {}
+for _name, _sikulix in list(_xlib_keys.items()) + list(_pynput_keys.items()):
+    keys[_name] = KeyInfo(_name, None, "Key." + _sikulix, None)
+for _name, _char in _special_chars.items():
+    keys[_name] = KeyInfo(_name, _char, None, None)
+for _name, _modifier in _modifiers.items():
+    keys[_name] = KeyInfo(_name, None, None, _modifier)
+
+# pynput Key members by their KeyInfo. Characters (KeyCode) are not in here, they depend on the keyboard layout.
+pynput_keys = {}
+
+
+def load_pynput_keys(pynput_keyboard):
+    """ Fills pynput_keys with the members of pynput.keyboard.Key. """
+    global keyboard
+    keyboard = pynput_keyboard
+    for name in _pynput_keys:
+        if hasattr(keyboard.Key, name):
+            pynput_keys[getattr(keyboard.Key, name)] = keys[name]
+    for name, canonical in (("ctrl", "Control_L"), ("ctrl_l", "Control_L"), ("shift", "Shift_L"), ("shift_l", "Shift_L"),
+                            ("alt", "Alt_L"), ("alt_l", "Alt_L"), ("cmd", "Super_L"), ("cmd_l", "Super_L"),
+                            ("ctrl_r", "Control_R"), ("shift_r", "Shift_R"), ("alt_r", "Alt_R"), ("alt_gr", "Alt_R"),
+                            ("cmd_r", "Super_R"), ("menu", "Menu")):
+        if hasattr(keyboard.Key, name):
+            # Several names can be aliases of the same member. The generic one (e.g. ctrl) comes first.
+            pynput_keys.setdefault(getattr(keyboard.Key, name), keys[canonical])
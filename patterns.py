@@ -0,0 +1,124 @@
+#!/usr/env python
+#
+# Makes the images stored while holding left SHIFT smaller and unique.
+# The image is compared with every position on the screen (normalized
+# cross-correlation, computed with FFTs). The smallest crop around its
+# center that doesn't match anywhere else is used, and the similarity
+# is set just above the best match somewhere else on the screen.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# python -m pip install numpy
+# Licence GPL3
+
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# region: (left, top, right, bottom) on the screen of the image as it was selected.
+# crop: (left, top, right, bottom) on the screen of the part of the image to use.
+# similarity: the similarity to use in Pattern().similar().
+# best_other: the best score of the crop at any other position on the screen.
+PatternInfo = namedtuple("PatternInfo", ["region", "crop", "similarity", "best_other"])
+
+fractions = (0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0)    # The crops tried, as a fraction of the width and height.
+min_size = 12               # The smallest crop in pixels.
+max_similarity = 0.95       # A crop is unique if it matches nowhere else with a score above this.
+min_similarity = 0.7        # The default similarity of Sikulix.
+margin = 0.02               # The similarity is this much above the best score elsewhere.
+
+
+class Screen:
+    """ A grayscale screenshot with what is needed to correlate many templates with it. """
+
+    def __init__(self, image):
+        self.pixels = numpy.asarray(image.convert("L"), dtype=numpy.float64)
+        self.height, self.width = self.pixels.shape
+        self.spectrum = numpy.fft.rfft2(self.pixels)
+        # Integral images of the pixels and their squares, with a row and column of zeros in front.
+        self.sums = numpy.zeros((self.height + 1, self.width + 1))
+        self.sums[1:, 1:] = self.pixels.cumsum(0).cumsum(1)
+        self.squares = numpy.zeros((self.height + 1, self.width + 1))
+        self.squares[1:, 1:] = (self.pixels * self.pixels).cumsum(0).cumsum(1)
+
+    def _window_sums(self, integral, h, w):
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    def ncc(self, left, top, right, bottom):
+        """ Returns the normalized cross-correlation (-1.0 - 1.0) of the region of the screen with
+            every position on the screen, indexed by [top, left]. None if the region is a single color. """
+        h = bottom - top
+        w = right - left
+        template = self.pixels[top:bottom, left:right]
+        template = template - template.mean()
+        energy = (template * template).sum()
+        if energy < 1e-6:
+            return None
+        correlation = numpy.fft.irfft2(self.spectrum * numpy.conj(numpy.fft.rfft2(template, s=self.pixels.shape)),
+                                       s=self.pixels.shape)[:self.height - h + 1, :self.width - w + 1]
+        n = h * w
+        window = self._window_sums(self.sums, h, w)
+        variance = self._window_sums(self.squares, h, w) - window * window / n
+        denominator = numpy.sqrt(numpy.maximum(variance, 0) * energy)
+        scores = numpy.zeros_like(correlation)
+        valid = denominator > 1e-6
+        scores[valid] = correlation[valid] / denominator[valid]
+        return scores
+
+    def best_other(self, left, top, right, bottom):
+        """ Returns the best score of the region anywhere but where it is, None if the region is a single color.
+            Positions less than half the size of the region away are the same place. """
+        scores = self.ncc(left, top, right, bottom)
+        if scores is None:
+            return None
+        h = bottom - top
+        w = right - left
+        scores[max(0, top - h // 2):top + h // 2 + 1, max(0, left - w // 2):left + w // 2 + 1] = -1.0
+        return float(scores.max())
+
+
+def tune(image, bbox):
+    """ Returns the PatternInfo for the region bbox (left, top, right, bottom) of image, a screenshot of
+        the whole screen. None if NumPy is not installed or the region is not on the screen.
+        The scores are computed on gray values, Sikulix uses colors, so they are a close estimate. """
+    if numpy is None:
+        return None
+    screen = Screen(image)
+    region = tuple(bbox)
+    left, top, right, bottom = bbox
+    left = max(0, left)
+    top = max(0, top)
+    right = min(screen.width, right)
+    bottom = min(screen.height, bottom)
+    if right - left < 2 or bottom - top < 2:
+        return None
+    center_x = (left + right) / 2.0
+    center_y = (top + bottom) / 2.0
+    best = None
+    for fraction in fractions:
+        w = min(right - left, max(min_size, int((right - left) * fraction)))
+        h = min(bottom - top, max(min_size, int((bottom - top) * fraction)))
+        crop_left = int(center_x - w / 2.0)
+        crop_top = int(center_y - h / 2.0)
+        crop = (crop_left, crop_top, crop_left + w, crop_top + h)
+        other = screen.best_other(*crop)
+        if other is None:
+            # A single color, it matches everywhere.
+            continue
+        if other < max_similarity:
+            return PatternInfo(region, crop, _similarity(other), other)
+        if best is None or other < best[1]:
+            best = (crop, other)
+    if best is None:
+        return None
+    # Not unique at any size, use the crop that is the least ambiguous.
+    return PatternInfo(region, best[0], _similarity(best[1]), best[1])
+
+
+def _similarity(best_other):
+    """ Just above the best score elsewhere, rounded up to two decimals. """
+    similarity = numpy.ceil((best_other + margin) * 100) / 100.0
+    return float(min(0.99, max(min_similarity, similarity)))
@@ -0,0 +1,108 @@
+#!/usr/env python
+#
+# Runs code_events and the saving of the images in a second process.
+# The recorder only writes the events into a ring in shared memory, so
+# the simplification of the mouse path, the commands and the png
+# encoding don't compete for the GIL with the input hooks.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import multiprocessing
+import code_events
+import ring
+
+# The settings of code_events and its capture worker that are copied to the second process.
+code_settings = ("output_folder", "precision", "step_size", "simplify_mode", "tolerance", "max_motions",
+                 "optimize_commands", "max_type_delay", "max_wheel_gap", "speed", "max_idle", "min_delay",
+                 "search_padding", "search_wait", "keyboard_layout", "capture_images")
+capture_settings = ("defer_encoding", "compress_level", "max_memory", "spill_folder", "backend", "tune_patterns")
+
+
+def _run(ring_name, capacity, settings, journal_filename, script_filename, trim, connection):
+    """ The second process: handles the events of the ring until it is closed. Writes the script while
+        recording and sends the number of lines, or sends the lines of the script without script_filename. """
+    import journal
+    for name, value in settings["code"].items():
+        setattr(code_events, name, value)
+    for name, value in settings["capture"].items():
+        setattr(code_events.capture_worker, name, value)
+    events = ring.EventRing(ring_name, capacity, create=False)
+    event_journal = journal_filename and journal.Journal(journal_filename)
+    code_events.reset()
+    if script_filename:
+        code_events.write_script(script_filename, trim)
+    writer = code_events.script_writer
+    if code_events.capture_images:
+        code_events.capture_worker.start()
+    for event in events.events():
+        if event_journal:
+            event_journal.append(*event)
+        code_events.handle_event(*event)
+    code_events.clean_up()
+    if event_journal:
+        event_journal.close()
+    if writer:
+        connection.send(writer.written)
+    else:
+        connection.send([str(command) for command in code_events.cmds.final])
+    connection.close()
+    events.release()
+
+
+class CodegenProcess:
+    """ Starts a process that converts the events to commands. Pass ring to the recorder as its journal:
+
+            codegen = CodegenProcess()
+            codegen.start()
+            record_events.journal = codegen.ring
+            try:
+                record_events.start_up()
+            finally:
+                lines = codegen.stop()
+
+        The settings of code_events are copied when start() is called. journal_filename is an optional
+        journal.Journal file, written by the second process. With script_filename the second process
+        writes the script while recording (see code_events.write_script()). """
+
+    def __init__(self, capacity=65536, journal_filename=None, script_filename=None, trim=False):
+        self.ring = ring.EventRing(capacity=capacity)
+        self.journal_filename = journal_filename
+        self.script_filename = script_filename
+        self.trim = trim
+        self.process = None
+        self._connection = None
+        self._report = None
+
+    def start(self):
+        settings = {"code": dict((name, getattr(code_events, name)) for name in code_settings),
+                    "capture": dict((name, getattr(code_events.capture_worker, name)) for name in capture_settings)}
+        self._connection, child = multiprocessing.Pipe(False)
+        self.process = multiprocessing.Process(target=_run, name="codegen",
+                                               args=(self.ring.name, self.ring.capacity, settings, self.journal_filename,
+                                                     self.script_filename, self.trim, child))
+        self.process.start()
+        child.close()
+
+    def stop(self, timeout=10):
+        """ Waits until all events are handled. Returns the number of lines written to script_filename,
+            or the lines of the script if there is no script_filename. The process is terminated if it
+            doesn't exit within timeout seconds after sending them. """
+        self.ring.close()
+        try:
+            lines = self._connection.recv()
+        except EOFError:
+            print("The code generating process stopped unexpectedly.")
+            lines = self.script_filename and 0 or []
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print("The code generating process didn't exit, terminating it.")
+            self.process.terminate()
+            self.process.join()
+        self._report = self.ring.report()
+        self.ring.release(unlink=True)
+        return lines
+
+    def report(self):
+        return self._report or self.ring.report()
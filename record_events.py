@@ -11,16 +11,25 @@
 # python -m pip install pynput 
 
 from pynput import keyboard, mouse
+import asyncio
+import threading
 import time
+import event_log
+import event_stream
+import keymap
+import stats
 
-myeventlist = []
-continue_listening = True
-first_time = True
+keymap.load_pynput_keys(keyboard)
+
+# Settings used by start_up(). A Recorder has its own copy of these.
+myeventlist = event_log.EventLog()
+log_raw_events = True       # Set to False to skip storing the raw events in myeventlist.
+journal = None              # A journal.Journal to stream the raw events to disk while recording.
+dispatcher = None           # A dispatcher.Dispatcher to call the handlers on one thread instead of in the callbacks.
+sampler = None              # A sampling.MotionSampler to drop motion events before they are stored or handled.
 simple_way_to_exit = True
-escape_cnt = 0
-keyboard_listener = None
-x = 0
-y = 0
+recorder = None             # The Recorder started by start_up()
+ready_handler = None        # Called by start_up() when the listeners are running, before the first event.
 
 # External handlers
 first_time_handler = None
@@ -28,230 +37,292 @@ keyboard_handler = None
 motion_handler = None
 mouse_button_handler = None
 
-# callback for key presses, the listener will pass us a key object that
-# indicates what key is being pressed
-def on_key_press(key):
-    # print("Key pressed: ", key, hasattr(key, "char")goedemorgen)
-    # so this is a bit of a quirk with pynput,
-    # if an alpha-numeric key is pressed the key object will have an attribute
-    # char which contains a string with the character, but it will only have
-    # this attribute with alpha-numeric, so if a special key is pressed
-    # this attribute will not be in the object.
-    # so, we end up having to check if the attribute exists with the hasattr
-    # function in python, and then check the character
-    # here is that in action:
-    global myeventlist
-    global first_time
-    global keyboard_listener
-
-    t = int(time.time() * 1000)  # in milisecs
-    if first_time_handler and first_time:
-        first_time_handler(t)
-        first_time = False
-    
-    if key in [keyboard.Key.enter, keyboard.Key.esc, keyboard.Key.tab, keyboard.Key.backspace, keyboard.Key.delete, keyboard.Key.f1, keyboard.Key.f2, keyboard.Key.f3, keyboard.Key.f4, keyboard.Key.f5, keyboard.Key.f6, keyboard.Key.f7, keyboard.Key.f8, keyboard.Key.f9, keyboard.Key.f10, keyboard.Key.f11, keyboard.Key.f12, keyboard.Key.f13, keyboard.Key.f14, keyboard.Key.f15, keyboard.Key.insert, keyboard.Key.space, keyboard.Key.home, keyboard.Key.end, keyboard.Key.left, keyboard.Key.right, keyboard.Key.down, keyboard.Key.up, keyboard.Key.page_down, keyboard.Key.page_up, keyboard.Key.print_screen, keyboard.Key.pause, keyboard.Key.caps_lock, keyboard.Key.scroll_lock, keyboard.Key.num_lock]:
-        key = str(key)[4:]
-    elif key == keyboard.Key.ctrl:
-        key = "Control_L"
-    elif key == keyboard.Key.shift:
-        key = "Shift_L"
-    elif key == keyboard.Key.alt: 
-        key = "Alt_L"
-    elif key == keyboard.Key.cmd: 
-        key = "Super_L"
-    elif key == keyboard.Key.ctrl_r: 
-        key = "Control_R"
-    elif key == keyboard.Key.shift_r: 
-        key = "Shift_R"
-    elif key == keyboard.Key.alt_r: 
-        key = "Alt_R"
-    elif key == keyboard.Key.cmd_r: 
-        key = "Super_R"
-    elif key == keyboard.Key.menu: 
-        key = "Menu"          
-    else:
-        # Scan code to name of key.
-        key = str(keyboard_listener.canonical(key)).strip("'")
-    # if isinstance(key, keyboard.Key):
-    #     print('Key:', key.name, key.value.vk, key.value)
-    #     name = key.name
-    # elif isinstance(key, keyboard.KeyCode):
-    #     print('KeyCode:', key.char, key.vk)
-    #     name = key.char51230.
-    # if hasattr(key, "char"):
-    #     myeventlist.append("%d\tKey\t%s\t%s\t%d\t%d"%(t, "Press", key.char, x, y))
-    #     if keyboard_handler:
-    #         keyboard_handler(t, "Press", key.char, x, y)
-    # else:H
-    myeventlist.append("%d\tKey\t%s\t%s\t%d\t%d"%(t, "Press", str(key), x, y))
-    if keyboard_handler:
-        keyboard_handler(t, "Press", str(key), x, y)
-
-# same as the key press callback, but for releasing keys
-def on_key_release(key):
-    global myeventlist
-    global first_time
-    global escape_cnt   
-    global continue_listening
-    global simple_way_to_exit
-    if key in [keyboard.Key.enter, keyboard.Key.esc, keyboard.Key.tab, keyboard.Key.backspace, keyboard.Key.delete, keyboard.Key.f1, keyboard.Key.f2, keyboard.Key.f3, keyboard.Key.f4, keyboard.Key.f5, keyboard.Key.f6, keyboard.Key.f7, keyboard.Key.f8, keyboard.Key.f9, keyboard.Key.f10, keyboard.Key.f11, keyboard.Key.f12, keyboard.Key.f13, keyboard.Key.f14, keyboard.Key.f15, keyboard.Key.insert, keyboard.Key.space, keyboard.Key.home, keyboard.Key.end, keyboard.Key.left, keyboard.Key.right, keyboard.Key.down, keyboard.Key.up, keyboard.Key.page_down, keyboard.Key.page_up, keyboard.Key.print_screen, keyboard.Key.pause, keyboard.Key.caps_lock, keyboard.Key.scroll_lock, keyboard.Key.num_lock]:
-        key = str(key)[4:]
-    elif key == keyboard.Key.ctrl:
-        key = "Control_L"
-    elif key == keyboard.Key.shift:
-        key = "Shift_L"
-    elif key == keyboard.Key.alt: 
-        key = "Alt_L"
-    elif key == keyboard.Key.cmd: 
-        key = "Super_L"
-    elif key == keyboard.Key.ctrl_r: 
-        key = "Control_R"
-    elif key == keyboard.Key.shift_r: 
-        key = "Shift_R"
-    elif key == keyboard.Key.alt_r: 
-        key = "Alt_R"
-    elif key == keyboard.Key.cmd_r: 
-        key = "Super_R"
-    elif key == keyboard.Key.menu: 
-        key = "Menu"      
-    else:
-        # Scan code to name of key.
-        key = str(keyboard_listener.canonical(key)).strip("'")
-
-    t = int(time.time() * 1000)  # in milisecs
-    # if hasattr(key, "char"):
-    #     myeventlist.append("%d\tKey\t%s\t%s\t%d\t%d"%(t, "Release", key.char, x, y))
-    #     if keyboard_handler:
-    #         keyboard_handler(t, "Release", key.char, x, y)
-    # else:
-    myeventlist.append("%d\tKey\t%s\t%s\t%d\t%d"%(t, "Release", str(key), x, y))
-    if keyboard_handler:
-        keyboard_handler(t, "Release", str(key), x, y)
-
-    if simple_way_to_exit:
-        # Press Escape to quit
-        if key == "esc":
-            print("Exiting.")
-            continue_listening = False
-            return False
-    else:
-        if key == "esc":
-            escape_cnt += 1
+
+class Recorder:
+    """ Records the keyboard and mouse with pynput and calls the handlers for every event.
+        Can be used as a context manager:
+
+            with Recorder(generator=code_events) as recorder:
+                recorder.wait()
+
+        generator is an optional module or object with the handlers of code_events. Its state
+        is reset when recording starts, so many recordings can be made in one process.
+
+        In asyncio code the raw events can be read with events():
+
+            recorder.start()
+            async for event in recorder.events():
+                ...     # event_log.Event(time, kind, code, x, y) """
+
+    def __init__(self, first_time_handler=None, keyboard_handler=None, motion_handler=None, mouse_button_handler=None,
+                 generator=None, simple_way_to_exit=True, log_raw_events=True, journal=None, dispatcher=None,
+                 sampler=None, myeventlist=None):
+        if generator:
+            first_time_handler = first_time_handler or generator.handle_first_time
+            keyboard_handler = keyboard_handler or generator.handle_keys
+            motion_handler = motion_handler or generator.handle_mouse_motion
+            mouse_button_handler = mouse_button_handler or generator.handle_mouse_buttons
+        self.generator = generator
+        self.first_time_handler = first_time_handler
+        self.keyboard_handler = keyboard_handler
+        self.motion_handler = motion_handler
+        self.mouse_button_handler = mouse_button_handler
+        self.simple_way_to_exit = simple_way_to_exit
+        self.log_raw_events = log_raw_events
+        self.journal = journal
+        self.dispatcher = dispatcher
+        self.sampler = sampler
+        self.myeventlist = myeventlist if myeventlist is not None else event_log.EventLog()
+        self.first_time = True
+        self.escape_cnt = 0
+        self.x = 0
+        self.y = 0
+        self.keyboard_listener = None
+        self.mouse_listener = None
+        self._key_names = {}        # Cache of the names of the KeyCodes (characters) seen so far.
+        self._stopped = threading.Event()
+        self._streams = []          # The event_stream.EventStreams of events(), replaced when changed.
+
+    def start(self):
+        """ Starts the listeners and returns immediately. """
+        if self.generator and hasattr(self.generator, "reset"):
+            self.generator.reset()
+        self.first_time = True
+        self.escape_cnt = 0
+        self._stopped.clear()
+        # create a listener and setup our call backs
+        # The callbacks are only wrapped when the statistics are enabled.
+        self.keyboard_listener = keyboard.Listener(on_press=stats.timed("on_key_press", self.on_key_press),
+                                                   on_release=stats.timed("on_key_release", self.on_key_release))
+        self.mouse_listener = mouse.Listener(on_move=stats.timed("on_mouse_move", self.on_mouse_move),
+                                             on_scroll=stats.timed("on_mouse_scroll", self.on_mouse_scroll),
+                                             on_click=stats.timed("on_mouse_click", self.on_mouse_click))
+        if self.dispatcher:
+            self.dispatcher.start()
+        self.keyboard_listener.start()
+        self.mouse_listener.start()
+
+    def stop(self):
+        """ Stops the listeners and handles the events that are still queued. Can be called more than once. """
+        self._request_stop()
+        for listener in (self.keyboard_listener, self.mouse_listener):
+            if listener:
+                listener.stop()
+                if listener is not threading.current_thread():
+                    listener.join()
+        self.keyboard_listener = self.mouse_listener = None
+        if self.dispatcher:
+            self.dispatcher.stop()
+
+    def wait(self, timeout=None):
+        """ Waits until recording is stopped by pressing Escape or by stop(). Returns True if it stopped. """
+        stopped = self._stopped.wait(timeout)
+        if stopped:
+            self.stop()
+        return stopped
+
+    async def events(self, maxsize=1024, overflow="drop-oldest"):
+        """ Async generator of the raw events (event_log.Event) from the moment it is first iterated
+            until recording stops. The events are queued on the listener threads, at most maxsize;
+            overflow is "drop-oldest" or "block" (the listeners wait for the loop), see EventStream. """
+        stream = event_stream.EventStream(asyncio.get_running_loop(), maxsize, overflow)
+        # Replaced instead of changed, the listener threads may be iterating over it.
+        self._streams = self._streams + [stream]
+        if self._stopped.is_set():
+            stream.close()
+        try:
+            async for event in stream:
+                yield event
+        finally:
+            stream.close()
+            self._streams = [s for s in self._streams if s is not stream]
+
+    def _request_stop(self):
+        self._stopped.set()
+        for stream in list(self._streams):
+            stream.close()
+
+    def is_recording(self):
+        return self.keyboard_listener is not None and not self._stopped.is_set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _log_event(self, t, kind, code, x, y):
+        """ Stores the raw event in myeventlist and the journal. """
+        if self.log_raw_events:
+            self.myeventlist.append(t, kind, code, x, y)
+        if self.journal:
+            self.journal.append(t, kind, code, x, y)
+        for stream in self._streams:
+            stream.put(event_log.Event(t, kind, code, x, y))
+
+    def _handle(self, handler, t, *args):
+        """ Calls an external handler, through the dispatcher if there is one. """
+        if self.dispatcher:
+            self.dispatcher.post(t, handler, t, *args)
+        else:
+            handler(t, *args)
+
+    def _first_time(self, t):
+        if self.first_time_handler:
+            self._handle(self.first_time_handler, t)
+        self.first_time = False
+
+    def _motion(self, t, x, y):
+        if self.first_time:
+            self._first_time(t)
+
+        # Watch out the mouse_positions can be negative. It seems that the mouse cursor will overshoot a bit.
+        self._log_event(t, event_log.MOTION, 0, x, y)
+        if self.motion_handler:
+            self._handle(self.motion_handler, t, x, y)
+
+    def _flush_motion(self):
+        """ Passes on the motion the sampler kept for just before a button or key event. """
+        motion = self.sampler.flush()
+        if motion:
+            self._motion(*motion)
+
+    def _key_name(self, key):
+        """ Returns the canonical name of a pynput Key or KeyCode. """
+        info = keymap.pynput_keys.get(key)
+        if info:
+            return info.name
+        name = self._key_names.get(key)
+        if name is None:
+            # Scan code to name of key.
+            name = self._key_names[key] = str(self.keyboard_listener.canonical(key)).strip("'")
+        return name
+
+    # callback for key presses, the listener will pass us a key object that
+    # indicates what key is being pressed
+    def on_key_press(self, key):
+        # so this is a bit of a quirk with pynput,
+        # if an alpha-numeric key is pressed the key object will have an attribute
+        # char which contains a string with the character, but it will only have
+        # this attribute with alpha-numeric, so if a special key is pressed
+        # this attribute will not be in the object.
+        t = int(time.time() * 1000)  # in milisecs
+        if self.sampler:
+            self._flush_motion()
+        if self.first_time:
+            self._first_time(t)
+        key = self._key_name(key)
+        self._log_event(t, event_log.KEY_PRESS, key, self.x, self.y)
+        if self.keyboard_handler:
+            self._handle(self.keyboard_handler, t, "Press", key, self.x, self.y)
+
+    # same as the key press callback, but for releasing keys
+    def on_key_release(self, key):
+        key = self._key_name(key)
+        t = int(time.time() * 1000)  # in milisecs
+        if self.sampler:
+            self._flush_motion()
+        self._log_event(t, event_log.KEY_RELEASE, key, self.x, self.y)
+        if self.keyboard_handler:
+            self._handle(self.keyboard_handler, t, "Release", key, self.x, self.y)
+
+        if self.simple_way_to_exit:
+            # Press Escape to quit
+            if key == "esc":
+                print("Exiting.")
+                self._request_stop()
+                return False
+        else:
+            if key == "esc":
+                self.escape_cnt += 1
+            else:
+                self.escape_cnt = 0
+            if self.escape_cnt > 2:
+                print("Exiting.")
+                self._request_stop()
+                return False
+
+    # the mouse click callback will give you the button pressed and its status, the
+    # callback will be triggered once when the button is pushed and again when released
+    # the is_pressed will tell you which state it's in
+    # there are several types of buttons it can recognize, but for the most part
+    # you'll just need the main 3: left, right and middle
+    def on_mouse_click(self, mouse_position_x, mouse_position_y, button, is_pressed):
+        self.x, self.y = mouse_position_x, mouse_position_y
+        buttons = {"Button.left":1, "Button.middle":2, "Button.right":3, "Button.x1":8, "Button.x2":9} # TODO check on Linux.
+        b = str(button).split(":")[0]
+        if not b in buttons.keys():
+            stats.log("Button '%s' not (yet) implemented." % button, "Button not (yet) implemented.")
+            return
+
+        t = int(time.time() * 1000)  # in milisecs
+        if self.sampler:
+            self._flush_motion()
+        if self.first_time:
+            self._first_time(t)
+
+        buttonno = buttons[b]
+        if is_pressed:
+            self._log_event(t, event_log.BUTTON_PRESS, buttonno, mouse_position_x, mouse_position_y)
+            if self.mouse_button_handler:
+                self._handle(self.mouse_button_handler, t, "Press", buttonno, mouse_position_x, mouse_position_y)
+        else:
+            self._log_event(t, event_log.BUTTON_RELEASE, buttonno, mouse_position_x, mouse_position_y)
+            if self.mouse_button_handler:
+                self._handle(self.mouse_button_handler, t, "Release", buttonno, mouse_position_x, mouse_position_y)
+
+    def on_mouse_move(self, mouse_position_x, mouse_position_y):
+        self.x, self.y = mouse_position_x, mouse_position_y  
+
+        t = int(time.time() * 1000)  # in milisecs
+        if self.sampler and not self.sampler.accept(t, mouse_position_x, mouse_position_y):
+            return
+        self._motion(t, mouse_position_x, mouse_position_y)
+
+    # So the mouse scroll callback will give you 2 sets of scroll changes, one for the x
+    # axis and one for the y. Most of the time the one you care about is the y axis change
+    def on_mouse_scroll(self, mouse_position_x, mouse_position_y, scroll_x_change, scroll_y_change):
+        """ Handler for scroll events of the mouse. """
+        self.x, self.y = mouse_position_x, mouse_position_y    
+
+        t = int(time.time() * 1000)  # in milisecs
+        if self.sampler:
+            self._flush_motion()
+        if self.first_time:
+            self._first_time(t)
+
+        # Linux handles scroll events as clicks of mouse button 4 (UP) and 5 (DOWN).
+        # TODO consider handling left and right scrolling.
+        if scroll_y_change == 1:
+            buttonno=4
+        elif scroll_y_change == -1:
+            buttonno = 5
         else:
-            escape_cnt = 0
-        if escape_cnt > 2:
-            print("Exiting.")
-            continue_listening = False
-            return False
-
-# the mouse click callback will give you the button pressed and its status, the
-# callback will be triggered once when the button is pushed and again when released
-# the is_pressed will tell you which state it's in
-# there are several types of buttons it can recognize, but for the most part
-# you'll just need the main 3: left, right and middle
-def on_mouse_click(mouse_position_x, mouse_position_y, button, is_pressed):
-    global myeventlist
-    global first_time
-    global x
-    global y
-    x, y = mouse_position_x, mouse_position_y
-    buttons = {"Button.left":1, "Button.middle":2, "Button.right":3, "Button.x1":8, "Button.x2":9} # TODO check on Linux.
-    b = str(button).split(":")[0]
-    if not b in buttons.keys():
-        print("Button '%s' not (yet) implemented." % button)
-        return
-
-    t = int(time.time() * 1000)  # in milisecs
-    if first_time_handler and first_time:
-        first_time_handler(t)
-        first_time = False
-
-    buttonno = buttons[b]
-    if is_pressed:
-        myeventlist.append("%d\tButton\tPress\t%s\t%d\t%d"%(t, str(buttonno), mouse_position_x, mouse_position_y))
-        if mouse_button_handler:
-            mouse_button_handler(t, "Press", buttonno, mouse_position_x, mouse_position_y)
-    else:
-        myeventlist.append("%d\tButton\tRelease\t%s\t%d\t%d"%(t, str(buttonno), mouse_position_x, mouse_position_y))
-        if mouse_button_handler:
-            mouse_button_handler(t, "Release", buttonno, mouse_position_x, mouse_position_y)
-
-def on_mouse_move(mouse_position_x, mouse_position_y):
-    global myeventlist
-    global first_time
-    global x
-    global y
-    x, y = mouse_position_x, mouse_position_y  
-
-    t = int(time.time() * 1000)  # in milisecs
-    if first_time_handler and first_time:
-        first_time_handler(t)
-        first_time = False
-
-    # Watch out the mouse_positions can be negative. It seems that the mouse cursor will overshoot a bit.
-    myeventlist.append("%d\tMotion\t%d\t%d"%(t, mouse_position_x, mouse_position_y))
-    if motion_handler:
-        motion_handler(t, mouse_position_x, mouse_position_y)
-
-# So the mouse scroll callback will give you 2 sets of scroll changes, one for the x
-# axis and one for the y. Most of the time the one you care about is the y axis change
-def on_mouse_scroll(mouse_position_x, mouse_position_y, scroll_x_change, scroll_y_change):
-    """ Handler for scroll events of the mouse. """
-    global myeventlist
-    global first_time
-    global x
-    global y
-    x, y = mouse_position_x, mouse_position_y    
-
-    t = int(time.time() * 1000)  # in milisecs
-    if first_time_handler and first_time:
-        first_time_handler(t)
-        first_time = False
-
-    # if scroll_x_change < 0:
-    #     print("user is scrolling to the left")
-    # elif scroll_x_change > 0:
-    #     print("user is scrolling to the right")
-    # if scroll_y_change > 0:
-    #     print("user is scrolling up the page")
-    # elif scroll_y_change < 0:
-    #     print("user is scrolling down the page")
-    # print("scroll change deltas: ", scroll_x_change, scroll_y_change)
-    
-    # Linux handles scroll events as clicks of mouse button 4 (UP) and 5 (DOWN).
-    # TODO consider handling left and right scrolling.
-    if scroll_y_change == 1:
-        buttonno=4
-    elif scroll_y_change == -1:
-        buttonno = 5
-    else:
-        # Not (yet) handled.
-        return
-    myeventlist.append("%d\tButton\tPress\t%s\t%d\t%d"%(t, str(buttonno), mouse_position_x, mouse_position_y))
-    if mouse_button_handler:
-        mouse_button_handler(t, "Press", buttonno, mouse_position_x, mouse_position_y)
-    myeventlist.append("%d\tButton\tRelease\t%s\t%d\t%d"%(t, str(buttonno), mouse_position_x, mouse_position_y))
-    if mouse_button_handler:
-        mouse_button_handler(t, "Release", buttonno, mouse_position_x, mouse_position_y)
+            # Not (yet) handled.
+            return
+        self._log_event(t, event_log.BUTTON_PRESS, buttonno, mouse_position_x, mouse_position_y)
+        if self.mouse_button_handler:
+            self._handle(self.mouse_button_handler, t, "Press", buttonno, mouse_position_x, mouse_position_y)
+        self._log_event(t, event_log.BUTTON_RELEASE, buttonno, mouse_position_x, mouse_position_y)
+        if self.mouse_button_handler:
+            self._handle(self.mouse_button_handler, t, "Release", buttonno, mouse_position_x, mouse_position_y)
 
 
 def start_up():
-    """ Initialise and start the recording of events. """
-    # create a listener and setup our call backs
-    global keyboard_listener
-    global continue_listening
-    keyboard_listener = keyboard.Listener(on_press=on_key_press, on_release=on_key_release)
-    mouse_listener = mouse.Listener(on_move=on_mouse_move, on_scroll=on_mouse_scroll, on_click=on_mouse_click)
-
-    # start the listener
-    keyboard_listener.start()
-    mouse_listener.start()
-    while continue_listening:
-        time.sleep(1)
-    keyboard_listener.stop()
-    mouse_listener.stop()
-    mouse_listener.join()    
-    keyboard_listener.join()   
+    """ Initialise and start the recording of events with the settings of this module.
+        Returns when recording is stopped. """
+    global recorder
+    recorder = Recorder(first_time_handler, keyboard_handler, motion_handler, mouse_button_handler,
+                        simple_way_to_exit=simple_way_to_exit, log_raw_events=log_raw_events,
+                        journal=journal, dispatcher=dispatcher, sampler=sampler, myeventlist=myeventlist)
+    with recorder:
+        if ready_handler:
+            recorder.keyboard_listener.wait()
+            recorder.mouse_listener.wait()
+            ready_handler()
+        recorder.wait()
 
 
 def clean_up():
@@ -260,21 +331,27 @@ def clean_up():
 
 
 if __name__ == "__main__":
-    import json    
+    import json
+    import journal as event_journal
 
     print("Recording keys and mouse. Press Escape to stop recording.")
     filename = "eventrecord.txt"
     print("Raw data is dumped in %s. [timestamp in ms, action, details]"%filename)
+    # Stream the events to disk while recording, the text and json files are created from the journal.
+    journal = event_journal.Journal(filename[:-3] + "ndjson")
+    log_raw_events = False
 
     start_up()
+    journal.close()
 
     # Store output.
+    events = [event_log.format_event(*event) for event in event_journal.read_journal(journal.filename)]
     f = open(filename, "w", encoding="utf-8")
-    for event in myeventlist:
+    for event in events:
         f.write(event + "\n")
     f.close()
 
     with open(filename[:-3] + "json", "w") as file:
-        json.dump(myeventlist, file)
+        json.dump(events, file)
 
     clean_up()
@@ -10,31 +10,119 @@
 # Install python-xlib for Xlib (no longer needed, but still possible. Install python-pynput)
 # This code is based on the example record_demo.py
 
+import struct
 import sys
 from Xlib import X, XK, display
 from Xlib.ext import record
 from Xlib.protocol import rq
+import event_log
+import stats
 
-local_dpy = display.Display()
-record_dpy = display.Display()
+# The connections to the X server are opened by open_displays(), not when this module is imported.
+local_dpy = None
+record_dpy = None
 
 ctx = None
-myeventlist = []
+myeventlist = event_log.EventLog()
+log_raw_events = True       # Set to False to skip storing the raw events in myeventlist.
+journal = None              # A journal.Journal to stream the raw events to disk while recording.
+dispatcher = None           # A dispatcher.Dispatcher to call the handlers on one thread instead of in the callbacks.
+sampler = None              # A sampling.MotionSampler to drop motion events before they are stored or handled.
 first_time = True
 simple_way_to_exit = True
 escape_cnt = 0
 
+ready_handler = None        # Called when the recording starts, before the first event.
+
 # External handlers
 first_time_handler = None
 keyboard_handler = None
 motion_handler = None
 mouse_button_handler = None
 
+def open_displays():
+    """ Opens the two connections to the X server, if they are not open yet. """
+    global local_dpy, record_dpy
+    if local_dpy is None:
+        local_dpy = display.Display()
+        record_dpy = display.Display()
+
+def has_record():
+    """ Returns if the X server has the RECORD extension. Opens the displays. """
+    open_displays()
+    return record_dpy.has_extension("RECORD")
+
+def _log_event(t, kind, code, x, y):
+    """ Stores the raw event in myeventlist and the journal. """
+    if log_raw_events:
+        myeventlist.append(t, kind, code, x, y)
+    if journal:
+        journal.append(t, kind, code, x, y)
+
+def _handle(handler, t, *args):
+    """ Calls an external handler, through the dispatcher if there is one. """
+    if dispatcher:
+        dispatcher.post(t, handler, t, *args)
+    else:
+        handler(t, *args)
+
+# The name of every keysym, built once. dir() is sorted and the first name of a keysym is used.
+keysym_names = {}
+for _name in dir(XK):
+    if _name[:3] == "XK_":
+        keysym_names.setdefault(getattr(XK, _name), _name[3:])
+keycode_keysyms = {}        # Cache of local_dpy.keycode_to_keysym(), cleared when the keyboard mapping changes.
+
 def lookup_keysym(keysym):
-    for name in dir(XK):
-        if name[:3] == "XK_" and getattr(XK, name) == keysym:
-            return name[3:]
-    return "[%d]" % keysym
+    name = keysym_names.get(keysym)
+    if name is None:
+        return "[%d]" % keysym
+    return name
+
+def keycode_to_keysym(keycode):
+    keysym = keycode_keysyms.get(keycode)
+    if keysym is None:
+        keysym = keycode_keysyms[keycode] = local_dpy.keycode_to_keysym(keycode, 0)
+    return keysym
+
+# The core input events are 32 bytes: type, detail, sequence number, time, root, event, child,
+# root_x, root_y, event_x, event_y, state, same_screen and a pad byte.
+CORE_EVENT = struct.Struct("=BBHIIIIhhhhHBx")
+core_event_types = frozenset((X.KeyPress, X.KeyRelease, X.ButtonPress, X.ButtonRelease, X.MotionNotify))
+GENERIC_EVENT = 35          # Events of extensions, longer than 32 bytes. Not in Xlib.X.
+fast_decoding = True        # Set to False to decode every event with the parser of python-xlib.
+reply_file = None           # A file opened with "wb" to store the data of the replies, see benchmarks/bench_xrecord.py
+
+def parse_events(data, dpy):
+    """ Yields (type, detail, time, root_x, root_y, event) for the events in data, decoding every
+        event with the parser of python-xlib. For other than core input events only type and event are set. """
+    while len(data):
+        event, data = rq.EventField(None).parse_binary_value(data, dpy, None, None)
+        if event.type in core_event_types:
+            yield event.type, event.detail, event.time, event.root_x, event.root_y, event
+        else:
+            yield event.type, None, None, None, None, event
+
+def decode_events(data, dpy):
+    """ Like parse_events(), but unpacks the core input events directly from data, without creating
+        an object for each of them. event is None for those. Other events are passed to the parser. """
+    if not fast_decoding or len(data) % CORE_EVENT.size:
+        # Longer events than the core events.
+        yield from parse_events(data, dpy)
+        return
+    offset = 0
+    for event_type, detail, sequence, time, root, window, child, root_x, root_y, event_x, event_y, state, same_screen \
+            in CORE_EVENT.iter_unpack(data):
+        event_type &= 0x7f      # Without the flag of events sent by a client
+        if event_type in core_event_types:
+            yield event_type, detail, time, root_x, root_y, None
+        elif event_type == GENERIC_EVENT:
+            # Longer than 32 bytes, the parser knows the length.
+            yield from parse_events(data[offset:], dpy)
+            return
+        else:
+            yield from parse_events(data[offset:offset + CORE_EVENT.size], dpy)
+        offset += CORE_EVENT.size
 
 def record_callback(reply):
     global myeventlist
@@ -49,36 +137,60 @@ def record_callback(reply):
         # not an event
         return
 
-    data = reply.data
-    while len(data):
-        event, data = rq.EventField(None).parse_binary_value(data, record_dpy.display, None, None)
+    if reply_file:
+        reply_file.write(struct.pack("<I", len(reply.data)) + reply.data)
+    for event_type, detail, time, root_x, root_y, event in decode_events(reply.data, record_dpy.display):
+        if event_type == X.MappingNotify:
+            # The keyboard mapping changed, forget the cached keysyms.
+            local_dpy.refresh_keyboard_mapping(event)
+            keycode_keysyms.clear()
+            continue
+        if event_type not in core_event_types:
+            continue
+        if sampler:
+            if event_type == X.MotionNotify:
+                if not sampler.accept(time, root_x, root_y):
+                    continue
+            else:
+                motion = sampler.flush()
+                if motion:
+                    # Handle the motion that was kept for just before this event first.
+                    if first_time_handler and first_time:
+                        _handle(first_time_handler, motion[0])
+                        first_time = False
+                    _log_event(motion[0], event_log.MOTION, 0, motion[1], motion[2])
+                    if motion_handler:
+                        _handle(motion_handler, *motion)
 
         if first_time_handler and first_time:
-            first_time_handler(event.time)
+            _handle(first_time_handler, time)
             first_time = False
         # All pen events are KeyReleases.
-        if event.type in [X.KeyPress, X.KeyRelease]:
-            pr = event.type == X.KeyPress and "Press" or "Release"
+        if event_type in [X.KeyPress, X.KeyRelease]:
+            pr = event_type == X.KeyPress and "Press" or "Release"
+            kind = event_type == X.KeyPress and event_log.KEY_PRESS or event_log.KEY_RELEASE
 
-            keysym = local_dpy.keycode_to_keysym(event.detail, 0)
+            keysym = keycode_to_keysym(detail)
             if not keysym:
-                myeventlist.append("%d\tKeyCode\t%s\t%s\t%d\t%d"%(event.time, pr, str(event.detail), event.root_x, event.root_y))
-                print("KeyCode%s" % pr, event.detail)
+                code_kind = event_type == X.KeyPress and event_log.KEYCODE_PRESS or event_log.KEYCODE_RELEASE
+                _log_event(time, code_kind, detail, root_x, root_y)
+                stats.log("KeyCode%s %s" % (pr, detail), "KeyCode without keysym")
             else:
-                myeventlist.append("%d\tKey\t%s\t%s\t%d\t%d"%(event.time, pr, lookup_keysym(keysym), event.root_x, event.root_y))
+                name = lookup_keysym(keysym)
+                _log_event(time, kind, name, root_x, root_y)
                 if keyboard_handler:
-                    keyboard_handler(event.time, pr, lookup_keysym(keysym), event.root_x, event.root_y )
+                    _handle(keyboard_handler, time, pr, name, root_x, root_y)
 
             if simple_way_to_exit:
                 # Press Escape to quit
-                if event.type == X.KeyPress and keysym == XK.XK_Escape:
+                if event_type == X.KeyPress and keysym == XK.XK_Escape:
                     local_dpy.record_disable_context(ctx)
                     local_dpy.flush()
                     return
             else:
-                if event.type == X.KeyPress and keysym == XK.XK_Escape:
+                if event_type == X.KeyPress and keysym == XK.XK_Escape:
                     escape_cnt += 1
-                elif event.type == X.KeyRelease and keysym == XK.XK_Escape:
+                elif event_type == X.KeyRelease and keysym == XK.XK_Escape:
                     pass
                 else:
                     escape_cnt = 0
@@ -87,22 +199,23 @@ def record_callback(reply):
                     local_dpy.flush()
                     return
 
-        elif event.type == X.ButtonPress:
-            myeventlist.append("%d\tButton\tPress\t%s\t%d\t%d"%(event.time, str(event.detail), event.root_x, event.root_y))
+        elif event_type == X.ButtonPress:
+            _log_event(time, event_log.BUTTON_PRESS, detail, root_x, root_y)
             if mouse_button_handler:
-                mouse_button_handler(event.time, "Press", event.detail, event.root_x, event.root_y)
-        elif event.type == X.ButtonRelease:
-            myeventlist.append("%d\tButton\tRelease\t%s\t%d\t%d"%(event.time, str(event.detail), event.root_x, event.root_y))
+                _handle(mouse_button_handler, time, "Press", detail, root_x, root_y)
+        elif event_type == X.ButtonRelease:
+            _log_event(time, event_log.BUTTON_RELEASE, detail, root_x, root_y)
             if mouse_button_handler:
-                mouse_button_handler(event.time, "Release", event.detail, event.root_x, event.root_y)
-        elif event.type == X.MotionNotify:
-            myeventlist.append("%d\tMotion\t%d\t%d"%(event.time, event.root_x, event.root_y))
+                _handle(mouse_button_handler, time, "Release", detail, root_x, root_y)
+        elif event_type == X.MotionNotify:
+            _log_event(time, event_log.MOTION, 0, root_x, root_y)
             if motion_handler:
-                motion_handler(event.time, event.root_x, event.root_y)
+                _handle(motion_handler, time, root_x, root_y)
 
 def start_up():
     """ Initialise and start the recording of events. """
     global ctx
+    open_displays()
     # Check if the extension is present
     if not record_dpy.has_extension("RECORD"):
         print("RECORD extension not found")
@@ -119,7 +232,7 @@ def start_up():
                     'core_replies': (0, 0),
                     'ext_requests': (0, 0, 0, 0),
                     'ext_replies': (0, 0, 0, 0),
-                    'delivered_events': (0, 0),
+                    'delivered_events': (X.MappingNotify, X.MappingNotify),     # To refresh keycode_keysyms
                     'device_events': (X.KeyPress, X.MotionNotify, X.CurrentTime, X.CursorShape),
                     'errors': (0, 0),
                     'client_started': False,
@@ -128,29 +241,49 @@ def start_up():
 
     # Enable the context; this only returns after a call to record_disable_context,
     # while calling the callback function in the meantime
-    record_dpy.record_enable_context(ctx, record_callback)
+    if dispatcher:
+        dispatcher.start()
+    if ready_handler:
+        ready_handler()
+    record_dpy.record_enable_context(ctx, stats.timed("record_callback", record_callback))
+    if dispatcher:
+        # Handle the events that are still queued.
+        dispatcher.stop()
 
 def clean_up():
     # Finally free the context
     global ctx
-    record_dpy.record_free_context(ctx)
+    if ctx is not None:
+        record_dpy.record_free_context(ctx)
+        ctx = None
 
 if __name__ == "__main__":
-    import json    
+    import json
+    import journal as event_journal
 
     print("Recording keys and mouse. Press Escape to stop recording.")
     filename = "/tmp/eventrecord.txt"
     print("Raw data is dumped in %s. [timestamp in ms, action, details]"%filename)
+    # Stream the events to disk while recording, the text and json files are created from the journal.
+    journal = event_journal.Journal(filename[:-3] + "ndjson")
+    log_raw_events = False
+    if "--save-replies" in sys.argv:
+        # The data of the replies as it came from the X server, for benchmarks/bench_xrecord.py
+        reply_file = open(filename[:-3] + "replies", "wb")
 
     start_up()
+    journal.close()
+    if reply_file:
+        reply_file.close()
 
     # Store output.
+    events = [event_log.format_event(*event) for event in event_journal.read_journal(journal.filename)]
     f = open(filename, "w", encoding="utf-8")
-    for event in myeventlist:
+    for event in events:
         f.write(event + "\n")
     f.close()
 
     with open(filename[:-3] + "json", "w") as file:
-        json.dump(myeventlist, file)
+        json.dump(events, file)
 
     clean_up()
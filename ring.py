@@ -0,0 +1,135 @@
+#!/usr/env python
+#
+# Ring buffer of fixed size event records in shared memory, to pass the
+# events of the recorder to another process. The recorder never waits:
+# when the ring is full the event is dropped and counted.
+# One process writes, one process reads. The threads of the writing process
+# (the listeners of pynput) take turns.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+import event_log
+
+# time (ms), x, y, code (button or keycode), kind, length of the name, name of the key (utf-8)
+RECORD = struct.Struct("<qiiiBB26s")
+# write count, read count, dropped, closed
+HEADER = struct.Struct("<QQQQ")
+
+
+class EventRing:
+    """ A ring of capacity event records in shared memory. Create it in one process and attach to it by
+        name in the other: EventRing(capacity=65536) and EventRing(name, capacity, create=False).
+        append() has the arguments of Journal.append(), so the ring can be used as the journal of a
+        recorder. """
+
+    def __init__(self, name=None, capacity=65536, create=True):
+        self.capacity = capacity
+        self.truncated = 0      # Key names that didn't fit in a record.
+        self._lock = threading.Lock()   # append() is called from more than one listener thread.
+        size = HEADER.size + capacity * RECORD.size
+        if create:
+            self._memory = shared_memory.SharedMemory(name, True, size)
+        else:
+            # The creator removes the memory, not the resource tracker of this process.
+            try:
+                self._memory = shared_memory.SharedMemory(name, False, size, track=False)
+            except TypeError:
+                # Before Python 3.13. A forked process shares the resource tracker of the creator.
+                self._memory = shared_memory.SharedMemory(name, False, size)
+                if multiprocessing.get_start_method() != "fork":
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(self._memory._name, "shared_memory")
+        self.name = self._memory.name
+        self._buffer = self._memory.buf
+        if create:
+            HEADER.pack_into(self._buffer, 0, 0, 0, 0, 0)
+
+    def append(self, time, kind, code, x, y):
+        """ Writes an event. Never waits for the reader, returns False if the ring was full and the event is
+            dropped. """
+        with self._lock:
+            return self._append(time, kind, code, x, y)
+
+    def _append(self, time, kind, code, x, y):
+        written, read, dropped, closed = HEADER.unpack_from(self._buffer, 0)
+        if written - read >= self.capacity:
+            struct.pack_into("<Q", self._buffer, 16, dropped + 1)
+            return False
+        if isinstance(code, str):
+            name = code.encode("utf-8")
+            if len(name) > 26:
+                self.truncated += 1
+                name = name[:26]
+            RECORD.pack_into(self._buffer, HEADER.size + (written % self.capacity) * RECORD.size,
+                             time, int(x), int(y), 0, kind, len(name), name)
+        else:
+            RECORD.pack_into(self._buffer, HEADER.size + (written % self.capacity) * RECORD.size,
+                             time, int(x), int(y), code, kind, 0, b"")
+        # The record is complete before the reader can see it.
+        struct.pack_into("<Q", self._buffer, 0, written + 1)
+        return True
+
+    def get(self):
+        """ Returns the oldest event as an event_log.Event, None if the ring is empty. """
+        written, read = struct.unpack_from("<QQ", self._buffer, 0)
+        if read == written:
+            return None
+        t, x, y, code, kind, length, name = RECORD.unpack_from(self._buffer, HEADER.size + (read % self.capacity) * RECORD.size)
+        struct.pack_into("<Q", self._buffer, 8, read + 1)
+        if length:
+            code = name[:length].decode("utf-8", "replace")
+        elif kind in (event_log.KEY_PRESS, event_log.KEY_RELEASE):
+            code = ""
+        return event_log.Event(t, kind, code, x, y)
+
+    def events(self, poll_interval=0.001):
+        """ Yields the events until the ring is closed and empty. Sleeps poll_interval seconds,
+            up to ten times as long when it stays empty, while waiting for new events. """
+        interval = poll_interval
+        while True:
+            event = self.get()
+            if event is not None:
+                interval = poll_interval
+                yield event
+            elif self.closed():
+                # Events written just before closing.
+                event = self.get()
+                if event is None:
+                    return
+                yield event
+            else:
+                time.sleep(interval)
+                interval = min(interval * 2, poll_interval * 10)
+
+    def close(self):
+        """ Tells the reader no more events will follow. """
+        struct.pack_into("<Q", self._buffer, 24, 1)
+
+    def closed(self):
+        return struct.unpack_from("<Q", self._buffer, 24)[0] != 0
+
+    def dropped(self):
+        return struct.unpack_from("<Q", self._buffer, 16)[0]
+
+    def depth(self):
+        written, read = struct.unpack_from("<QQ", self._buffer, 0)
+        return written - read
+
+    def report(self):
+        written = struct.unpack_from("<Q", self._buffer, 0)[0]
+        return "Event ring: %d events passed on, %d dropped because the ring was full, %d key names truncated." % (
+            written, self.dropped(), self.truncated)
+
+    def release(self, unlink=False):
+        """ Detaches from the shared memory. The creator unlinks it when both processes are done. """
+        self._buffer.release()
+        self._memory.close()
+        if unlink:
+            self._memory.unlink()
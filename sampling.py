@@ -0,0 +1,65 @@
+#!/usr/env python
+#
+# Drops motion events in the recorder, before they are stored or handled.
+# Mice with a high polling rate send 500-1000 events per second, most of
+# them are thrown away by code_events anyway.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+
+class MotionSampler:
+    """ Decides which motion events are passed on.
+        max_rate: the maximum number of motion events per second (None for no limit).
+        min_distance: the minimum distance in pixels from the previous motion event that was passed on.
+        endpoints_only: only pass on the last motion before a button or key event, see flush(). """
+
+    def __init__(self, max_rate=None, min_distance=None, endpoints_only=False):
+        self.min_interval = max_rate and 1000.0 / max_rate or 0     # in ms
+        self.min_distance = min_distance or 0
+        self.endpoints_only = endpoints_only
+        self.passed = 0
+        self.dropped_rate = 0
+        self.dropped_distance = 0
+        self.dropped_endpoints = 0
+        self._min_distance2 = self.min_distance * self.min_distance
+        self._last = None           # The last event passed on
+        self._pending = None        # The last event in endpoints only mode
+
+    def accept(self, t, x, y):
+        """ Returns True if the motion event at time t (ms) should be passed on. """
+        if self.endpoints_only:
+            if self._pending:
+                self.dropped_endpoints += 1
+            self._pending = (t, x, y)
+            return False
+        last = self._last
+        if last:
+            if t - last[0] < self.min_interval:
+                self.dropped_rate += 1
+                return False
+            dx = x - last[1]
+            dy = y - last[2]
+            if dx * dx + dy * dy < self._min_distance2:
+                self.dropped_distance += 1
+                return False
+        self._last = (t, x, y)
+        self.passed += 1
+        return True
+
+    def flush(self):
+        """ Call before a button or key event. In endpoints only mode returns the (t, x, y) of
+            the last motion, which should be passed on before the event. Otherwise returns None. """
+        pending = self._pending
+        if pending:
+            self._pending = None
+            self.passed += 1
+        return pending
+
+    def dropped(self):
+        return self.dropped_rate + self.dropped_distance + self.dropped_endpoints
+
+    def report(self):
+        return "Motion events passed on: %d, dropped: %d (max rate: %d, min distance: %d, endpoints only: %d)." % (
+            self.passed, self.dropped(), self.dropped_rate, self.dropped_distance, self.dropped_endpoints)
@@ -0,0 +1,160 @@
+#!/usr/env python
+#
+# Streams the commands of code_events to the Sikulix script while
+# recording. Only the last commands, that can still be taken back or
+# changed, are kept in memory. The final commands are written to the
+# .py file by a background thread.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import queue
+import threading
+import commands
+
+# The Enter that started the recorder and the Esc that stopped it.
+start_keys = ("type(Key.ENTER)", "type(\"enter\")")
+stop_keys = ("type(Key.ESC)", "type(\"esc\")")
+
+
+class CommandSink:
+    """ The commands of a recording. Commands are appended at the end. The commands appended since a
+        savepoint() can be taken back with rollback(), as long as they are not released.
+        release() passes the commands that can't change anymore on to output, in order, and forgets
+        them. Only the tail that isn't released yet is kept. Without an output the released commands
+        are kept in final. """
+
+    def __init__(self, output=None):
+        self.output = output        # Called with every released command.
+        self.final = []             # The released commands, if there is no output.
+        self._tail = []             # The commands that are not released yet.
+        self._released = 0          # The number of commands released.
+        # The handlers append for almost every event, list.append is much faster than a method.
+        self.append = self._tail.append
+
+    def __len__(self):
+        return self._released + len(self._tail)
+
+    def savepoint(self):
+        """ Returns the position of the next command, for rollback() and release(). """
+        return len(self)
+
+    def rollback(self, savepoint):
+        """ Removes the commands appended since savepoint. Released commands can't be taken back. """
+        del self._tail[max(0, savepoint - self._released):]
+
+    def release(self, limit=None, prepare=None):
+        """ Passes on the commands before the savepoint limit, all commands if limit is None.
+            prepare is called with every command before it is passed on. If it returns False the
+            command, and the commands after it, are held until the next release().
+            Returns the number of commands passed on. """
+        tail = self._tail
+        count = len(tail)
+        if limit is not None and limit - self._released < count:
+            count = limit - self._released
+        if count <= 0:
+            return 0
+        done = count
+        if prepare is not None:
+            for index in range(count):
+                if prepare(tail[index]) is False:
+                    done = index
+                    break
+            if done == 0:
+                return 0
+        released = tail[:done]
+        del tail[:done]
+        self._released += done
+        if self.output is None:
+            self.final.extend(released)
+        else:
+            for command in released:
+                self.output(command)
+        return done
+
+
+def _is_type_delay(command):
+    return isinstance(command, commands.Setting) and command.name == "TypeDelay"
+
+
+def skip_start_keys(stream, keys=start_keys):
+    """ Filter that leaves out the keys (str() of the Type commands) the stream starts with, with
+        their TypeDelay settings. """
+    held = []           # TypeDelay settings before the first other command
+    stream = iter(stream)
+    for command in stream:
+        if _is_type_delay(command):
+            held.append(command)
+            continue
+        if isinstance(command, commands.Type) and str(command) in keys:
+            del held[:]
+            continue
+        for setting in held:
+            yield setting
+        yield command
+        break
+    else:
+        for setting in held:
+            yield setting
+    for command in stream:
+        yield command
+
+
+def drop_stop_keys(stream, keys=stop_keys):
+    """ Filter that leaves out the keys (str() of the Type commands) the stream ends with, with
+        their TypeDelay settings. """
+    held = []           # TypeDelay settings and keys, dropped if nothing else follows.
+    for command in stream:
+        if _is_type_delay(command) or (isinstance(command, commands.Type) and str(command) in keys):
+            held.append(command)
+            continue
+        for c in held:
+            yield c
+        del held[:]
+        yield command
+
+
+class ScriptWriter:
+    """ Writes the commands passed to write() to the Sikulix script filename on a background thread,
+        one line per command, optimized with commands.optimize() if optimize is True. With trim the
+        Enter the script starts with and the Esc it ends with are left out (the keys that started
+        and stopped the recorder). max_wait limits the merged waits. The file is flushed whenever the
+        writer has caught up. """
+
+    def __init__(self, filename, optimize=True, max_type_delay=1.0, max_wheel_gap=0.5, trim=False, max_wait=None):
+        self.filename = filename
+        self.optimize = optimize
+        self.max_type_delay = max_type_delay
+        self.max_wheel_gap = max_wheel_gap
+        self.trim = trim
+        self.max_wait = max_wait
+        self.written = 0
+        self._queue = queue.Queue()
+        self._file = open(filename, "w", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="script", daemon=True)
+        self._thread.start()
+
+    def write(self, command):
+        """ Queue a command. The command must not be changed anymore. """
+        self._queue.put(command)
+
+    def close(self):
+        """ Writes all queued commands and closes the file. """
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+    def _run(self):
+        stream = iter(self._queue.get, None)
+        if self.trim:
+            stream = drop_stop_keys(skip_start_keys(stream))
+        if self.optimize:
+            stream = commands.optimize(stream, self.max_type_delay, self.max_wheel_gap, self.max_wait)
+        for command in stream:
+            self._file.write(str(command) + "\n")
+            self.written += 1
+            if self._queue.empty():
+                self._file.flush()
@@ -23,14 +23,21 @@ __version__ = (0, 0, 1)
 
 import sys
 import os
-import code_events
-import record_events
+import time
+
+# When the program started, to measure how long it takes until the recording starts.
+start_time = time.perf_counter()
 
 help_text = """ Usage: python sikulix_recorder.py <name Sikulix folder>
 
 --help  -h      show this help.
 --tripple -t    Press Escape three times to exit, instead of once.
 
+--backend  auto|pynput|xlib  How the mouse and keyboard are recorded. xlib
+                            uses the RECORD extension of the X server and
+                            needs python-xlib. auto uses xlib on X11 if it
+                            is available, pynput otherwise. Default = auto
+
 The number of mouseMove commands generated depends on two factors: the 
 precision and the step size. The step size determines how many events
 of the motion are skipped. 0 means no events are skipped (this means
@@ -46,103 +53,326 @@ straight lines to select buttons, the precision can be much lower
 --precision -p  <float>     Set precision. Default = 6
 --step  -s  <int>           Set step size. Default = 15
 
+Before the script is written, runs of keystrokes are combined into one
+type() command, notches of the mouse wheel into one wheel() command and
+successive waits into one wait().
+
+--no-optimize               Write every command as it was recorded.
+
+The waits and delays copy the timing of the recording. To replay faster:
+
+--speed  <float>            Replay speed, e.g. 2.0 halves all waits. Default = 1
+--max-idle  <float>         Max number of seconds of a single wait or delay,
+                            e.g. 2.0 to skip long pauses.
+--min-delay  <float>        Min number of seconds of a wait or delay, to give
+                            the application time to respond.
+
+Instead of the precision and step size, the path can also be simplified
+so it never deviates more than a number of pixels from the recorded
+path (Ramer-Douglas-Peucker). Faster for long drawings if NumPy is
+installed.
+
+--rdp   -r  <float>         Simplify with a tolerance in pixels, e.g. 2.0
+
+Mice with a high polling rate send many more motion events than needed.
+They can be dropped while recording:
+
+--max-rate  <float>         Max number of motion events per second.
+--min-distance  <int>       Drop motion events closer than this number of
+                            pixels to the previous one.
+--endpoints-only            Only keep the mouse position just before a
+                            click or key press. No mouseMove paths.
+
 While recording hold LEFT SHIFT and move the mouse from the upper left
 corner to the bottom right corner of the area you want to save. Click
 inside this area to store the x and y offset from the middle of the
 image.
 
+Saving the images as png files takes most of the CPU time of the recorder.
+It can be done at the end of the recording instead, on all cores:
+
+--defer-encoding            Keep the images in memory (max 256 MB, the rest
+                            is stored in temporary files) and save them
+                            when recording stops.
+--compress-level  <int>     png compression, 0 (fast) - 9 (small). Default = 6
+--capture  auto|xlib|pil    How the screen is grabbed. xlib keeps one
+                            connection to the X server open. Default = auto
+
+Sikulix searches the whole screen for the images. That is slow on large
+screens. The images can be searched for near the place they were recorded
+first:
+
+--search-region  <int>      Search within this many pixels around the
+                            recorded location first, e.g. 100.
+--tune-patterns             Compare each image with the whole screen and
+                            only save the smallest part of it that is
+                            unique, with the similarity just above the best
+                            match elsewhere. Needs NumPy.
+
 While recording hold LEFT CTRL and move the mouse to indicate an area
 to highlight this area.
 
+--processes                 Create the commands and save the images in a
+                            second process, so the recorder always keeps
+                            up with the mouse and keyboard.
+
+--stats [<file.json>]       Measure the callbacks, handlers and screenshots
+                            while recording. Prints a summary at exit, or
+                            writes it to the json file.
+
 --version   -v              Shows version number and quits.
 """
 
-if __name__ == "__main__":
-    if "--help" in sys.argv or "-h" in sys.argv or len(sys.argv) < 2:
-        print(help_text)
-    else:
-        # Creating a folder_name
-        folder_name = sys.argv[1]
-        if not folder_name.endswith(".sikuli") and not folder_name.endswith(".sikuli" + os.path.sep):
-            base_name = folder_name
-            folder_name += ".sikuli"
-        else:
-            base_name = folder_name[:-7]
-        if not folder_name.endswith(os.path.sep):
-             folder_name += os.path.sep 
-        filename = folder_name + base_name + ".py"
-        os.makedirs(folder_name, exist_ok = True)
-        code_events.output_folder = folder_name
-
-        # Setting up the recorder's code handlers
-        record_events.first_time_handler = code_events.handle_first_time
-        record_events.keyboard_handler = code_events.handle_keys
-        record_events.motion_handler = code_events.handle_mouse_motion
-        record_events.mouse_button_handler = code_events.handle_mouse_buttons
-
-        # Handle the other command line arguments
-        if "--version" in sys.argv or "-v" in sys.argv:
-            print("Version: %s" % __version__)
-            sys.exit(0)
-        if "--tripple" in sys.argv or "-t" in sys.argv:
-            record_events.simple_way_to_exit = False
-            print("Repeat pressing Esc three times to stop recording.")
-        else:
-            print("Press Esc to stop recording.")
-        if "--precision" in sys.argv or "-p" in sys.argv:
-            try:
-                index = sys.argv.index("--precision")
-            except:
-                try:
-                    index = sys.argv.index("-p")
-                except:
-                    pass
-            if len(sys.argv) < index + 2:
-                print("Missing value for 'precision'. Please add a number after the switch.")
-                sys.exit(1)
-            try:
-                code_events.precision = float(sys.argv[index + 1])
-                print("Set precision to:" +  code_events.precision)
-            except:
-                print("Warning: unable to get value for precision. Not a float number.")
+# The options: switch, short switch, name, type of the value. The type is None for a switch
+# without a value, a tuple for a choice and "json" for an optional json filename.
+options = (
+    ("--tripple", "-t", "tripple", None),
+    ("--backend", None, "backend", ("auto", "pynput", "xlib")),
+    ("--precision", "-p", "precision", float),
+    ("--step", "-s", "step", int),
+    ("--rdp", "-r", "rdp", float),
+    ("--max-rate", None, "max_rate", float),
+    ("--min-distance", None, "min_distance", int),
+    ("--endpoints-only", None, "endpoints_only", None),
+    ("--no-optimize", None, "no_optimize", None),
+    ("--speed", None, "speed", float),
+    ("--max-idle", None, "max_idle", float),
+    ("--min-delay", None, "min_delay", float),
+    ("--defer-encoding", None, "defer_encoding", None),
+    ("--compress-level", None, "compress_level", int),
+    ("--capture", None, "capture", ("auto", "xlib", "pil")),
+    ("--search-region", None, "search_region", int),
+    ("--tune-patterns", None, "tune_patterns", None),
+    ("--processes", None, "processes", None),
+    ("--stats", None, "stats", "json"),
+)
+
+# Checks of the values: name, test, message.
+checks = (
+    ("speed", lambda value: value > 0, "speed must be a positive number."),
+    ("max_idle", lambda value: value >= 0, "max-idle must be a positive number."),
+    ("min_delay", lambda value: value >= 0, "min-delay must be a positive number."),
+    ("min_distance", lambda value: value >= 0, "min-distance must be a positive number."),
+    ("search_region", lambda value: value >= 0, "search-region must be a positive number."),
+    ("compress_level", lambda value: 0 <= value <= 9, "compress-level must be between 0 and 9."),
+)
+
+type_names = {float: "a float number", int: "a integer"}
+
+
+def parse_arguments(arguments):
+    """ Returns a dictionary with the value of every option given in arguments, the arguments after
+        the folder name. Switches without a value are True. Exits with a message on a wrong value. """
+    switches = {}
+    for option in options:
+        switches[option[0]] = option
+        if option[1]:
+            switches[option[1]] = option
+    settings = {}
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        index += 1
+        if argument not in switches:
+            print("Warning: unknown option '%s'." % argument)
+            continue
+        switch, short_switch, name, value_type = switches[argument]
+        if value_type is None:
+            settings[name] = True
+        elif value_type == "json":
+            settings[name] = True
+            if index < len(arguments) and arguments[index].endswith(".json"):
+                settings[name] = arguments[index]
+                index += 1
+        elif index >= len(arguments):
+            print("Missing value for '%s'. Please add a value after the switch." % switch[2:])
+            sys.exit(1)
+        elif isinstance(value_type, tuple):
+            if arguments[index] not in value_type:
+                print("Warning: the value of %s must be %s or %s." % (switch[2:], ", ".join(value_type[:-1]), value_type[-1]))
                 sys.exit(1)
-        if "--step" in sys.argv or "-s" in sys.argv:
+            settings[name] = arguments[index]
+            index += 1
+        else:
             try:
-                index = sys.argv.index("--step")
-            except:
-                try:
-                    index = sys.argv.index("-s")
-                except:
-                    pass
-            if len(sys.argv) < index + 2:
-                print("Missing value for 'step'. Please add a number after the switch.")
+                settings[name] = value_type(arguments[index])
+            except ValueError:
+                print("Warning: unable to get value for %s. Not %s." % (switch[2:], type_names[value_type]))
                 sys.exit(1)
+            index += 1
+    for name, test, message in checks:
+        if name in settings and not test(settings[name]):
+            print("Warning: " + message)
+            sys.exit(1)
+    return settings
+
+
+def load_backend(name):
+    """ Returns the module that records the mouse and keyboard: record_events_unix for xlib,
+        record_events for pynput. Only the module of the backend is imported. """
+    if name in ("auto", "xlib"):
+        if sys.platform.startswith("linux") and os.environ.get("DISPLAY"):
             try:
-                code_events.step_size = int(sys.argv[index + 1])
-                print("Set step size to: " + code_events.step_size)
-            except:
-                print("Warning: unable to get value for step size. Not a integer.")
-                sys.exit(1)
-        
-        
+                import record_events_unix
+                if record_events_unix.has_record():
+                    return record_events_unix
+                print("The X server has no RECORD extension.")
+            except Exception as e:
+                print("Unable to record with Xlib: %s" % e)
+        elif name == "xlib":
+            print("Recording with Xlib needs an X11 display.")
+        if name == "xlib":
+            sys.exit(1)
+    import record_events
+    return record_events
 
-        print("Storing the recording in '%s'. Overwriting if it already exists." % folder_name)
+
+if __name__ == "__main__":
+    if "--help" in sys.argv or "-h" in sys.argv or len(sys.argv) < 2:
+        print(help_text)
+        sys.exit(0)
+    if "--version" in sys.argv or "-v" in sys.argv:
+        print("Version: %s" % (__version__,))
+        sys.exit(0)
+    settings = parse_arguments(sys.argv[2:])
+
+    # Creating a folder_name
+    folder_name = sys.argv[1]
+    if not folder_name.endswith(".sikuli") and not folder_name.endswith(".sikuli" + os.path.sep):
+        base_name = folder_name
+        folder_name += ".sikuli"
+    else:
+        base_name = folder_name[:-7]
+    if not folder_name.endswith(os.path.sep):
+         folder_name += os.path.sep
+    filename = folder_name + base_name + ".py"
+
+    # Only now the modules needed for recording are imported.
+    import code_events
+    import journal
+    import dispatcher
+    import sampling
+    import stats
+    import pipeline
+    record_events = load_backend(settings.get("backend", "auto"))
+    os.makedirs(folder_name, exist_ok = True)
+    code_events.output_folder = folder_name
+
+    # Setting up the recorder's code handlers
+    record_events.first_time_handler = code_events.handle_first_time
+    record_events.keyboard_handler = code_events.handle_keys
+    record_events.motion_handler = code_events.handle_mouse_motion
+    record_events.mouse_button_handler = code_events.handle_mouse_buttons
+
+    # Handle the other command line arguments
+    if settings.get("tripple"):
+        record_events.simple_way_to_exit = False
+        print("Repeat pressing Esc three times to stop recording.")
+    else:
+        print("Press Esc to stop recording.")
+    if "precision" in settings:
+        code_events.precision = settings["precision"]
+        print("Set precision to: %s" % code_events.precision)
+    if "step" in settings:
+        code_events.step_size = settings["step"]
+        print("Set step size to: %s" % code_events.step_size)
+    if "rdp" in settings:
+        code_events.tolerance = settings["rdp"]
+        code_events.simplify_mode = "rdp"
+        print("Simplify the mouse path with a tolerance of %s pixels." % code_events.tolerance)
+    if settings.get("no_optimize"):
+        code_events.optimize_commands = False
+    for name in ("speed", "max_idle", "min_delay"):
+        if name in settings:
+            setattr(code_events, name, settings[name])
+    if settings.get("defer_encoding"):
+        code_events.capture_worker.defer_encoding = True
+    if "compress_level" in settings:
+        code_events.capture_worker.compress_level = settings["compress_level"]
+    if "search_region" in settings:
+        code_events.search_padding = settings["search_region"]
+    if settings.get("tune_patterns"):
+        code_events.capture_worker.tune_patterns = True
+    if "capture" in settings:
+        code_events.capture_worker.backend = settings["capture"]
+    stats_file = None
+    if "stats" in settings:
+        stats.enabled = True
+        if settings["stats"] is not True:
+            stats_file = settings["stats"]
+        # Only wrapped when enabled, so there is no overhead without --stats.
+        record_events.first_time_handler = stats.timed_handler("handle_first_time", code_events.handle_first_time)
+        record_events.keyboard_handler = stats.timed_handler("handle_keys", code_events.handle_keys)
+        record_events.motion_handler = stats.timed_handler("handle_mouse_motion", code_events.handle_mouse_motion)
+        record_events.mouse_button_handler = stats.timed_handler("handle_mouse_buttons", code_events.handle_mouse_buttons)
+    if settings.get("max_rate") or settings.get("min_distance") or settings.get("endpoints_only"):
+        record_events.sampler = sampling.MotionSampler(settings.get("max_rate"), settings.get("min_distance"),
+                                                       settings.get("endpoints_only", False))
+
+    def report_ready():
+        print("Recording with %s, ready after %d ms." % (
+            record_events.__name__, (time.perf_counter() - start_time) * 1000))
+
+    record_events.ready_handler = report_ready
+    if stats.enabled and record_events.first_time_handler:
+        first_time_handler = record_events.first_time_handler
+
+        def note_first_event(*args):
+            # The time from the start of the program until the first event is handled.
+            stats.observe("time to first event", int((time.perf_counter() - start_time) * 1000), "ms")
+            first_time_handler(*args)
+
+        record_events.first_time_handler = note_first_event
+
+    print("Storing the recording in '%s'. Overwriting if it already exists." % folder_name)
+    record_events.log_raw_events = False
+    if settings.get("processes"):
+        # The recorder only passes the events to the second process, through shared memory.
+        # The second process writes the journal, and the script without the Enter of the start
+        # command and the Esc stopping the recorder.
+        codegen = pipeline.CodegenProcess(journal_filename=folder_name + "events.ndjson", script_filename=filename, trim=True)
+        codegen.start()
+        record_events.journal = codegen.ring
+        record_events.first_time_handler = record_events.keyboard_handler = None
+        record_events.motion_handler = record_events.mouse_button_handler = None
+        try:
+            record_events.start_up()
+        finally:
+            # Also when recording fails or is interrupted, else exiting waits for the second process,
+            # which waits for more events.
+            codegen.ring.close()
+            lines = codegen.stop()
+        print(codegen.report())
+        if record_events.sampler:
+            print(record_events.sampler.report())
+        record_events.clean_up()
+    else:
+        # Get the screen grabber ready, so the first image doesn't have to wait for it.
+        code_events.capture_worker.start()
+        # Write the Sikulix code while recording, without the Enter of the start command and the Esc
+        # stopping the recorder.
+        code_events.write_script(filename, trim=True)
+        writer = code_events.script_writer
+        # Stream the raw events to disk while recording, instead of keeping them in memory.
+        # The script can be rebuilt from this file if the recorder doesn't exit normally.
+        record_events.journal = journal.Journal(folder_name + "events.ndjson")
+        # Call the code handlers on one thread, in the order the events happened.
+        record_events.dispatcher = dispatcher.Dispatcher()
         record_events.start_up()
         # Waiting for the previous command to exit.
+        record_events.journal.close()
+        print(record_events.dispatcher.report())
+        if record_events.sampler:
+            print(record_events.sampler.report())
 
         record_events.clean_up()
         code_events.clean_up()
+        lines = writer.written
+    if stats.enabled:
+        if stats_file:
+            stats.write(stats_file)
+            print("Statistics written to '%s'." % stats_file)
+        else:
+            print(stats.report())
 
-        # Save the Sikulix code.
-        f = open(filename, "w", encoding="utf-8")
-        # It seems like we are recording the Enter of the start command. Remove it
-        code = code_events.cmds[2:]
-        if len(code) >= 2 and code[1] == "type(Key.ENTER)" or code[1] == "type(\"enter\")":
-            code = code[2:]
-
-        # Remove the ESC sequence needed to stop the recorder.
-        while len(code) and code[-1] == "type(Key.ESC)" or code[-1] == "type(\"esc\")":
-            code = code[:-2]
-        for r in code:
-            f.write(r + "\n")
-        f.close()
\ No newline at end of file
+    print("Wrote %d lines to '%s'." % (lines, filename))
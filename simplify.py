@@ -0,0 +1,121 @@
+#!/usr/env python
+#
+# Simplification of the path of the mouse, so a recorded motion of
+# thousands of events results in a few mouseMove commands.
+# Uses NumPy when it is installed, otherwise plain Python.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# python -m pip install numpy
+# Licence GPL3
+
+# NumPy is imported by rdp(), it isn't needed in the default "slope" mode and takes long to import.
+
+
+class SlopeFilter:
+    """ Selects the points of a path where the slope changes more than precision, at least step_size
+        points after the previous selected one. The points are added one by one and add() returns True
+        for the selected points. Constant work per point. A vertical segment only differs from a non
+        vertical one if the slope of the latter is below precision. """
+
+    def __init__(self, precision=6, step_size=15):
+        self.reset(precision, step_size)
+
+    def reset(self, precision, step_size):
+        self.precision = precision
+        self.step_size = step_size
+        self.count = 0
+        self.x = self.y = None
+        self.prior_slope = None     # None is straight up or down
+        self.old_index = -1000000
+
+    def add(self, x, y):
+        n = self.count
+        self.count = n + 1
+        if n:
+            dx = x - self.x
+            slope = None if dx == 0 else float(y - self.y) / dx
+            prior_slope = self.prior_slope
+            self.prior_slope = slope
+        self.x = x
+        self.y = y
+        if n < 2:
+            return False
+        if slope is None or prior_slope is None:
+            if slope is None:
+                changed = prior_slope is not None and abs(prior_slope) < self.precision
+            else:
+                changed = abs(slope) < self.precision
+        else:
+            changed = abs(slope - prior_slope) > self.precision
+        if changed and n - self.old_index > self.step_size:
+            self.old_index = n
+            return True
+        return False
+
+
+def rdp(x_values, y_values, tolerance):
+    """ Ramer-Douglas-Peucker simplification. Returns the sorted indices of the points to keep,
+        so that no point of the path is more than tolerance pixels away from the simplified path.
+        The first and the last point are always kept. """
+    n = len(x_values)
+    if n < 3:
+        return list(range(n))
+    try:
+        import numpy
+    except ImportError:
+        return _rdp(x_values, y_values, tolerance)
+    x = numpy.asarray(x_values, dtype=numpy.float64)
+    y = numpy.asarray(y_values, dtype=numpy.float64)
+    keep = [0, n - 1]
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        xs = x[first + 1:last] - x[first]
+        ys = y[first + 1:last] - y[first]
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        length = numpy.hypot(dx, dy)
+        if length:
+            distances = numpy.abs(xs * dy - ys * dx) / length
+        else:
+            distances = numpy.hypot(xs, ys)
+        worst = int(numpy.argmax(distances))
+        if distances[worst] > tolerance:
+            index = first + 1 + worst
+            keep.append(index)
+            stack.append((first, index))
+            stack.append((index, last))
+    keep.sort()
+    return keep
+
+
+def _rdp(x_values, y_values, tolerance):
+    n = len(x_values)
+    keep = [0, n - 1]
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        dx = x_values[last] - x_values[first]
+        dy = y_values[last] - y_values[first]
+        length = (dx * dx + dy * dy) ** 0.5
+        worst = None
+        max_distance = tolerance
+        for i in range(first + 1, last):
+            xs = x_values[i] - x_values[first]
+            ys = y_values[i] - y_values[first]
+            if length:
+                distance = abs(xs * dy - ys * dx) / length
+            else:
+                distance = (xs * xs + ys * ys) ** 0.5
+            if distance > max_distance:
+                max_distance = distance
+                worst = i
+        if worst is not None:
+            keep.append(worst)
+            stack.append((first, worst))
+            stack.append((worst, last))
+    keep.sort()
+    return keep
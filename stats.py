@@ -0,0 +1,175 @@
+#!/usr/env python
+#
+# Counters and latency histograms of the hot path of the recorder, and a
+# logger that limits the number of messages printed while recording.
+# Nothing is measured unless enabled is set to True before the handlers
+# are wrapped, so the overhead is zero when --stats is not used.
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import json
+import threading
+import time
+
+enabled = False
+counters = {}
+histograms = {}
+# count() and observe() are called from the listener, dispatcher, journal and capture threads.
+_lock = threading.Lock()
+
+
+class Histogram:
+    """ Counts values in buckets of powers of two: bucket n holds the values from 2**(n-1) up to 2**n.
+        Keeps the count, total, minimum and maximum, so observing a value is a few operations. """
+
+    def __init__(self, unit=""):
+        self.unit = unit
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.buckets[min(63, int(value).bit_length())] += 1
+            self.count += 1
+            self.total += value
+            if self.max is None or value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def percentile(self, fraction):
+        """ Returns the upper bound of the bucket that holds the value at fraction (0.0 - 1.0). """
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for n, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** n, self.max)
+        return self.max
+
+    def summary(self):
+        return {"unit": self.unit, "count": self.count, "mean": self.count and self.total / float(self.count),
+                "min": self.min, "max": self.max, "p50": self.percentile(0.50), "p99": self.percentile(0.99),
+                "buckets": dict((2 ** n, count) for n, count in enumerate(self.buckets) if count)}
+
+
+def count(name, n=1):
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def observe(name, value, unit=""):
+    histogram = histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(unit)
+    histogram.observe(value)
+
+
+def timed(name, function):
+    """ Returns function wrapped so the duration of every call is stored in the histogram name (in us).
+        Returns function itself if the statistics are not enabled. """
+    if not enabled or function is None:
+        return function
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram("us")
+    clock = time.perf_counter_ns
+
+    def wrapper(*args):
+        start = clock()
+        try:
+            return function(*args)
+        finally:
+            histogram.observe((clock() - start) // 1000)
+    return wrapper
+
+
+def timed_handler(name, function):
+    """ Like timed(), for the handlers of code_events. Their first argument is the time stamp of the event
+        in ms, the lag between the event and the moment it is handled is stored in "<name> lag".
+        Xlib time stamps don't use the clock of time.time(), so the lag is measured relative to the
+        event that was handled the fastest. """
+    if not enabled or function is None:
+        return function
+    lag = histograms.get(name + " lag")
+    if lag is None:
+        lag = histograms[name + " lag"] = Histogram("ms")
+    function = timed(name, function)
+    offset = [None]
+
+    def wrapper(time_stamp, *args):
+        delta = int(time.time() * 1000) - time_stamp
+        if offset[0] is None or delta < offset[0]:
+            offset[0] = delta
+        lag.observe(delta - offset[0])
+        return function(time_stamp, *args)
+    return wrapper
+
+
+def reset():
+    counters.clear()
+    histograms.clear()
+    log.suppressed.clear()
+
+
+def summary():
+    with _lock:
+        return {"counters": dict(counters), "histograms": dict((name, histogram.summary()) for name, histogram in histograms.items()),
+                "suppressed messages": dict(log.suppressed)}
+
+
+def report():
+    """ Returns the statistics as text. """
+    lines = []
+    for name in sorted(counters):
+        lines.append("%-40s %10d" % (name, counters[name]))
+    for name in sorted(histograms):
+        histogram = histograms[name]
+        if histogram.count:
+            lines.append("%-40s %10d x  mean %10.1f  p50 <= %8d  p99 <= %8d  max %8d %s" % (
+                name, histogram.count, histogram.total / float(histogram.count), histogram.percentile(0.50),
+                histogram.percentile(0.99), histogram.max, histogram.unit))
+    for message, suppressed in sorted(log.suppressed.items()):
+        lines.append("%-40s %10d suppressed" % (message[:40], suppressed))
+    return "\n".join(lines)
+
+
+def write(filename):
+    with open(filename, "w") as file:
+        json.dump(summary(), file, indent=2)
+
+
+class RateLimitedLogger:
+    """ Prints a message at most once every interval seconds. The messages in between are counted. """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.suppressed = {}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, message, key=None):
+        """ key groups messages that differ only in their details, by default the message itself. """
+        key = key or message
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return
+            self._last[key] = now
+        print(message)
+
+
+log = RateLimitedLogger()
@@ -0,0 +1,54 @@
+#!/usr/env python
+#
+# Tests of the peephole optimizer of the Sikulix commands.
+# Run from the main folder: python -m unittest discover tests
+#
+# Written by Tom Hunter
+# Copyright May 16th, 2024
+# Licence GPL3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from commands import Hover, MouseDown, MouseUp, Setting, Type, Wait, Wheel, optimize
+
+
+def lines(commands, **options):
+    return [str(command) for command in optimize(commands, **options)]
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def test_wheel_burst_then_click_at_the_same_spot(self):
+        # The hover to where the mouse already is goes, the waits around it become one.
+        recorded = [Hover(5, 5), Wheel("Button.WHEEL_UP"), Wait(0.1), Wheel("Button.WHEEL_UP"), Wait(0.1),
+                    Hover(5, 5), Wait(2.0), MouseDown("Button.LEFT"), MouseUp("Button.LEFT")]
+        self.assertEqual(lines(recorded), ["hover(Location(5, 5))", "wheel(Button.WHEEL_UP, 2)", "wait(2.200000)",
+                                           "mouseDown(Button.LEFT)", "mouseUp(Button.LEFT)"])
+
+    def test_merged_waits_are_limited_to_max_wait(self):
+        recorded = [Hover(5, 5), Wait(1.5), Wait(1.5), Hover(6, 6), Wait(0.5)]
+        self.assertEqual(lines(recorded, max_wait=2.0), ["hover(Location(5, 5))", "wait(2.000000)",
+                                                         "hover(Location(6, 6))", "wait(0.500000)"])
+
+    def test_typing_with_spaces_is_folded(self):
+        recorded = [Setting("TypeDelay", 0.0), Type("a"), Setting("TypeDelay", 0.2), Type("Key.SPACE", key=True),
+                    Setting("TypeDelay", 0.2), Type("b")]
+        self.assertEqual(lines(recorded), ["Settings.TypeDelay = 0.2", "type(\"a b\")"])
+
+    def test_pause_ends_a_run_of_keys(self):
+        recorded = [Setting("TypeDelay", 0.0), Type("a"), Setting("TypeDelay", 3.0), Type("b")]
+        self.assertEqual(lines(recorded, max_type_delay=1.0), ["Settings.TypeDelay = 0.0", "type(\"a\")",
+                                                               "Settings.TypeDelay = 3.0", "type(\"b\")"])
+
+    def test_overwritten_settings_are_dropped(self):
+        recorded = [Setting("MoveMouseDelay", 0.1), Setting("MoveMouseDelay", 0.2), Hover(1, 1),
+                    Setting("MoveMouseDelay", 0.2), Hover(2, 2)]
+        self.assertEqual(lines(recorded), ["Settings.MoveMouseDelay = 0.200000", "hover(Location(1, 1))",
+                                           "hover(Location(2, 2))"])
+
+
+if __name__ == "__main__":
+    unittest.main()